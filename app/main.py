@@ -7,10 +7,15 @@ from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 
 from .routers import stats_router, user_router, token_router, record_one_router, \
-    record_two_router
-from .services import stats_services
+    record_two_router, metrics_router
+from .services import stats_services, keycloak_services, \
+    keycloak_async_services, database_services
+from .services.user_directory_services import user_directory
+from .services.count_services import record_counts
+from .services.metrics_services import MetricsMiddleware
 
 # Import the dotenv library to load environment variables from .env file
 config = dotenv.dotenv_values(".env")
@@ -27,8 +32,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Add the middleware that measures the requests, it is the outermost one so
+# the time of the other middlewares is included
+app.add_middleware(MetricsMiddleware)
+
 # Mount the 'StaticFiles' class at the route '/static'
 # This allows the application to serve static files from the 'static' directory
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -48,25 +58,62 @@ def startup_db_client():
         f'{config["MONGO_PORT"]}/?authMechanism=DEFAULT'
     app.mongodb_client = MongoClient(mongo_uri)
     app.database = app.mongodb_client[config["MONGO_DB_NAME"]]
+    # Async client used by the record services
+    app.motor_client = AsyncIOMotorClient(
+        mongo_uri,
+        maxPoolSize=int(config.get("MONGO_MAX_POOL_SIZE") or 100)
+    )
+    app.async_database = app.motor_client[config["MONGO_DB_NAME"]]
+
+    # Create the pool of connections to Keycloak
+    keycloak_services.init_http_client()
+    keycloak_async_services.init_http_client()
+    # Start the background synchronization of the users
+    user_directory.start()
 
     try:
         # The sercer_info() command will throw an exception if the connection
         # fails
         app.mongodb_client.server_info()
         print("INFO:     Connected to the MongoDB database.")
+        # Create the indexes of the record collections
+        missing = database_services.ensure_indexes(app.database)
+        for collection_name, index_names in missing.items():
+            print(
+                f"ERROR:    Missing indexes in {collection_name}: " + \
+                    ", ".join(index_names)
+            )
+        # Compute the readers of the records that do not have them yet
+        migrated = database_services.migrate_readers(app.database)
+        for collection_name, count in migrated.items():
+            if count:
+                print(
+                    f"INFO:     Computed the readers of {count} records " + \
+                        f"of {collection_name}."
+                )
+        # Start the background refresh of the number of records
+        record_counts.start(app.database)
     except Exception as e:
         print(f"ERROR:    Unable to connect to the MongoDB database. {e}")
 
 
 # Define a function that runs when the application shuts down
 @app.on_event("shutdown")
-def shutdown_db_client():
-    # Close the MongoDB client connection
+async def shutdown_db_client():
+    # Close the MongoDB client connections
     app.mongodb_client.close()
+    app.motor_client.close()
+    # Stop the synchronization of the users and close the connections to
+    # Keycloak
+    user_directory.stop()
+    record_counts.stop()
+    keycloak_services.close_http_client()
+    await keycloak_async_services.close_http_client()
 
 # Define a function that handles GET requests to the root route
+# It is not async because get_stats blocks, so it runs in the threadpool
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
+def home(request: Request):
     # Get the number of users
     stats = stats_services.get_stats(request)
     return templates.TemplateResponse("index.html", {
@@ -85,6 +132,7 @@ async def home(request: Request):
 
 
 app.include_router(stats_router.router, tags=["stats"], prefix="/stats")
+app.include_router(metrics_router.router, tags=["stats"], prefix="/metrics")
 app.include_router(user_router.router, tags=["users"], prefix="/user")
 app.include_router(
     record_one_router.router, tags=[config['RECORD_ONE_TAG']],
@@ -38,6 +38,7 @@ class RecordOne(BaseModel):
     connections: Union[List[Connection], None]
     editors: Union[List[str], None]
     viewers: Union[List[str], None]
+    version: Union[int, None] = None
 
 
 # Record to be updated
@@ -48,14 +49,18 @@ class UpdateRecordOne(BaseModel):
     connections: Union[List[Connection], None] = None
     editors: Union[List[str], None] = None
     viewers: Union[List[str], None] = None
+    version: Union[int, None] = None
 
 
 class UpdateRecordOneConnections(BaseModel):
     type: str  = config['RECORD_TWO_NAME']
-    id: str
+    id: Union[str, None] = None
+    ids: Union[List[str], None] = None
     operation: Literal['add', 'remove']
+    version: Union[int, None] = None
 
 
 class UpdateRecordOneContent(BaseModel):
     content: Union[List[dict], None] = None
-    operation: Literal['add', 'remove']
\ No newline at end of file
+    operation: Literal['add', 'remove']
+    version: Union[int, None] = None
\ No newline at end of file
@@ -19,6 +19,7 @@ class RecordTwo(BaseModel):
     owner: str
     editors: Union[List[str], None]
     viewers: Union[List[str], None]
+    version: Union[int, None] = None
 
 # Record to be updated
 class UpdateRecordTwo(BaseModel):
@@ -27,3 +28,4 @@ class UpdateRecordTwo(BaseModel):
     visible: Union[bool, None] = None
     editors: Union[List[str], None] = None
     viewers: Union[List[str], None] = None
+    version: Union[int, None] = None
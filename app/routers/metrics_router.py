@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from ..services.metrics_services import metrics, PROMETHEUS_CONTENT_TYPE
+
+router = APIRouter()
+
+
+@router.get("",
+    response_class=PlainTextResponse,
+    summary="Retrieve the request metrics of the API in the Prometheus " + \
+        "text format.")
+async def get_metrics():
+    return PlainTextResponse(
+        metrics.prometheus(), media_type=PROMETHEUS_CONTENT_TYPE
+    )
@@ -3,13 +3,17 @@ from fastapi import APIRouter, Depends, Body, Response, HTTPException, \
     Request, Query, UploadFile
 from fastapi.responses import HTMLResponse
 from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from typing import List
 from dotenv import dotenv_values
 from ..models.user_model import User
 from ..models.record_one_model import RecordOne, NewRecordOne, \
     UpdateRecordOne, UpdateRecordOneConnections, UpdateRecordOneContent
 from ..services import keycloak_services, record_one_services, \
-    record_two_services, plot_services
+    record_two_services, plot_services, streaming_services
+from ..services.user_directory_services import user_directory
+from ..services.pagination_services import default_limit, max_limit
+from ..services.database_services import TitleExistsError
 
 
 router = APIRouter()
@@ -23,7 +27,13 @@ config = dotenv_values(".env")
     responses={
         200: {
             "model": List[RecordOne],
-            "description": f"List of all {config['RECORD_ONE_TAG']}."
+            "description": f"List of all {config['RECORD_ONE_TAG']}. " + \
+                "The X-Next-Cursor header has the cursor of the next page. " + \
+                "Send Accept: application/x-ndjson to get one record " + \
+                "per line."
+        },
+        400: {
+            "description": "Invalid cursor, or cursor used with search"
         },
         500: {
             "description": "There was an error retrieving the " + \
@@ -32,10 +42,23 @@ config = dotenv_values(".env")
     },
     summary=f"Retrieve a list of all {config['RECORD_ONE_TAG']}."
 )
-def get_records_one(
+async def get_records_one(
     response: Response, request: Request,
     title: str = Query(
-        None, description="Optional - String to search in the title"
+        None, description="Optional - Beginning of the title"
+    ),
+    search: str = Query(
+        None, description="Optional - Words to search in the title and " + \
+            "the description. The records are sorted by relevance and " + \
+            "only the first page is returned"
+    ),
+    limit: int = Query(
+        default_limit, ge=1, le=max_limit,
+        description="Optional - Maximum number of records to return"
+    ),
+    cursor: str = Query(
+        None, description="Optional - Cursor of the page, returned in the " + \
+            "X-Next-Cursor header of the previous page"
     ),
     current_user: User = Depends(keycloak_services.optional_get_current_user)
 ):
@@ -44,7 +67,15 @@ def get_records_one(
         username = current_user['username']
     else:
         username = None
-    return record_one_services.get_records_one(username, title, request)
+    try:
+        records, next_cursor = await record_one_services.get_records_one(
+            username, title, request, limit, cursor, search=search
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Send the records while they are read from the database
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return streaming_services.records_response(records, request, headers)
 
 
 @router.get("/me",
@@ -52,7 +83,12 @@ def get_records_one(
         200: {
             "model": List[RecordOne],
             "description": f"List of {config['RECORD_ONE_TAG']} " + \
-                "belonging to the current user."
+                "belonging to the current user. The X-Next-Cursor " + \
+                "header has the cursor of the next page. Send Accept: " + \
+                "application/x-ndjson to get one record per line."
+        },
+        400: {
+            "description": "Invalid cursor, or cursor used with search"
         },
         500: {
             "description": "There was an error retrieving the " + \
@@ -62,17 +98,37 @@ def get_records_one(
     summary=f"Retrieve a list of {config['RECORD_ONE_TAG']} " + \
         "belonging to the current user."
 )
-def get_records_one_me(
+async def get_records_one_me(
     response: Response, request: Request,
     title: str = Query(
-        None, description="Optional - String to search in the title"
+        None, description="Optional - Beginning of the title"
+    ),
+    search: str = Query(
+        None, description="Optional - Words to search in the title and " + \
+            "the description. The records are sorted by relevance and " + \
+            "only the first page is returned"
+    ),
+    limit: int = Query(
+        default_limit, ge=1, le=max_limit,
+        description="Optional - Maximum number of records to return"
+    ),
+    cursor: str = Query(
+        None, description="Optional - Cursor of the page, returned in the " + \
+            "X-Next-Cursor header of the previous page"
     ),
     current_user: User = Depends(keycloak_services.get_current_user)
 ):
     response.status_code = 200
-    return record_one_services.get_records_one_me(
-        current_user['username'], title, request
-    )
+    try:
+        records, next_cursor = await record_one_services.get_records_one_me(
+            current_user['username'], title, request, limit, cursor,
+            search=search
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Send the records while they are read from the database
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return streaming_services.records_response(records, request, headers)
 
 
 @router.get("/{id}",
@@ -91,10 +147,10 @@ def get_records_one_me(
     },
     summary=f"Retrieve a {config['RECORD_ONE_NAME']} given its ID."
 )
-def get_record_one(
+async def get_record_one(
     response: Response, request: Request, id: str
 ):
-    record = record_one_services.get_record_one(id, request)
+    record = await record_one_services.get_record_one(id, request)
     if record:
         response.status_code = 200
         return record
@@ -121,13 +177,15 @@ def get_record_one(
     },
     summary=f"Retrieve a plot of a {config['RECORD_ONE_NAME']} given its ID."
 )
-def get_record_one_plot(
+async def get_record_one_plot(
     request: Request, id: str, x: str, y: str
 ):
-    record = record_one_services.get_record_one(id, request)
+    record = await record_one_services.get_record_one(
+        id, request, content=False
+    )
     if record:
         return HTMLResponse(
-            content=plot_services.plot(record, x, y),
+            content=await plot_services.plot_record(record, x, y, request),
             status_code=200
         )
     else:
@@ -158,70 +216,67 @@ def get_record_one_plot(
     },
     summary=f"Create a new {config['RECORD_ONE_NAME']}."
 )
-def create_record_one(
+async def create_record_one(
     response: Response, request: Request, record_one: NewRecordOne = Body(),
     current_user: User = Depends(keycloak_services.get_current_user)
 ):
     new_record_one = jsonable_encoder(record_one)
-    # Check if title is unique
-    unique = record_one_services.title_is_unique(
-        new_record_one["title"], request
+    # Add visible to the new record if it is not present
+    if "visible" not in new_record_one:
+        new_record_one["visible"] = True
+    # Check if the editors or viewers are valid users
+    editors = new_record_one.get("editors") or []
+    viewers = new_record_one.get("viewers") or []
+    unknown = await run_in_threadpool(
+        user_directory.find_unknown, editors + viewers
     )
-    if unique:
-        # Add visible to the new record if it is not present
-        if "visible" not in new_record_one:
-            new_record_one["visible"] = True
-        # Check if the editors or viewers are valid users
-        if "editors" in new_record_one and new_record_one["editors"]:
-            for editor in new_record_one["editors"]:
-                if not keycloak_services.user_exists(editor):
-                    raise HTTPException(
-                        status_code=404,
-                        detail='Editor not found'
-                    )
-        if "viewers" in new_record_one and new_record_one["viewers"]:
-            for viewer in new_record_one["viewers"]:
-                if not keycloak_services.user_exists(viewer):
-                    raise HTTPException(
-                        status_code=404,
-                        detail='Viewer not found'
-                    )
-        # Check if the connections are valid
-        if "connections" in new_record_one and new_record_one["connections"]:
-            for connection in new_record_one["connections"]:
-                record_type = connection["type"]
-                record_id = connection["id"]
-                if record_type == config['RECORD_TWO_NAME']:
-                    # Check if the record exists
-                    record_two = record_two_services.get_record_two(
-                        record_id, request
-                    )
-                    if not record_two:
-                        raise HTTPException(
-                            status_code=404,
-                            detail=f'{config["RECORD_TWO_NAME"]} not found'
-                        )
-                else:
-                    raise HTTPException(
-                        status_code=404,
-                        detail='Connection type not found'
-                    )
-
-        # Create the record
-        response.status_code = 201
-        new_record = record_one_services.create_record_one(
-            new_record_one, current_user['username'], request
+    if any(editor in unknown for editor in editors):
+        raise HTTPException(
+            status_code=404,
+            detail='Editor not found'
         )
-        # Convert the _id field to id
-        new_record["id"] = str(new_record["_id"])
-        del new_record["_id"]
-        return new_record
+    if unknown:
+        raise HTTPException(
+            status_code=404,
+            detail='Viewer not found'
+        )
+    # Check if the connections are valid
+    if "connections" in new_record_one and new_record_one["connections"]:
+        connections = new_record_one["connections"]
+        if any(
+            connection["type"] != config['RECORD_TWO_NAME']
+            for connection in connections
+        ):
+            raise HTTPException(
+                status_code=404,
+                detail='Connection type not found'
+            )
+        # Check if the records exist and get their titles in one query
+        titles = await record_two_services.get_titles(
+            [connection["id"] for connection in connections], request
+        )
+        if any(connection["id"] not in titles for connection in connections):
+            raise HTTPException(
+                status_code=404,
+                detail=f'{config["RECORD_TWO_NAME"]} not found'
+            )
+        for connection in connections:
+            connection["title"] = titles[connection["id"]]
 
-    else:
+    # Create the record, the unique index on the title rejects duplicates
+    new_record = await record_one_services.create_record_one(
+        new_record_one, current_user['username'], request
+    )
+    if new_record is None:
         raise HTTPException(
             status_code=409,
             detail='Title already exists'
         )
+    response.status_code = 201
+    # Convert the _id field to id
+    new_record["id"] = str(new_record["_id"])
+    del new_record["_id"]
+    return new_record
 
 
 @router.put("/{id}",
@@ -242,6 +297,11 @@ def create_record_one(
         404: {
             "description": f"{config['RECORD_ONE_NAME']} not found"
         },
+        409: {
+            "description": f"The {config['RECORD_ONE_NAME']} was modified by " + \
+                "another request, its version is not the given version, " + \
+                "or the title already exists"
+        },
         500: {
             "description": "There was an error updating the " + \
                 f"{config['RECORD_ONE_NAME']}."
@@ -249,21 +309,23 @@ def create_record_one(
     },
     summary=f"Update a {config['RECORD_ONE_NAME']} given its ID."
 )
-def update_record_one(
+async def update_record_one(
     response: Response, request: Request, id: str,
     record_one: UpdateRecordOne = Body(),
-    current_user: User = Depends(keycloak_services.get_current_user)
+    current_user: User = Depends(keycloak_services.get_current_user),
+    # Read after the user is authenticated
+    record: dict = Depends(record_one_services.load_record_one)
 ):
     record_one = jsonable_encoder(record_one)
+    version = record_one.get("version")
     # Check if the record exists
-    record = record_one_services.get_record_one(id, request)
     if not record:
         raise HTTPException(
             status_code=404,
             detail=f"{config['RECORD_ONE_NAME']} not found"
         )
     # Check if the record is owned or editable by the current user
-    editable = record_one_services.is_editable(
+    editable = await record_one_services.is_editable(
         id, current_user['username'], request)
     if not editable:
         raise HTTPException(
@@ -272,12 +334,24 @@ def update_record_one(
                 f"this operation because the {config['RECORD_ONE_NAME']}" + \
                 " does not belong to you or you are not an editor"
         )
-    record = record_one_services.update_record_one(
-        id, record_one, request
-    )
+    try:
+        record = await record_one_services.update_record_one(
+            id, record_one, request
+        )
+    except TitleExistsError:
+        raise HTTPException(
+            status_code=409,
+            detail='Title already exists'
+        )
     if record:
         response.status_code = 200
         return record
+    elif version is not None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"The {config['RECORD_ONE_NAME']} was modified by " + \
+                "another request, its version is not the given version"
+        )
     else:
         raise HTTPException(
             status_code=500,
@@ -302,31 +376,38 @@ def update_record_one(
                 " does not belong to you or you are not an editor"
         },
         404: {
-            "description": f"{config['RECORD_ONE_NAME']} not found"
+            "description": f"{config['RECORD_ONE_NAME']} not found, or " + \
+                f"{config['RECORD_TWO_NAME']} to connect not found"
+        },
+        409: {
+            "description": f"The {config['RECORD_ONE_NAME']} was modified by " + \
+                "another request, its version is not the given version"
         },
         500: {
             "description": "There was an error updating the " + \
                 f"{config['RECORD_ONE_NAME']}."
         }
     },
-    summary=f"Update the connections of a {config['RECORD_ONE_NAME']} " + \
-        "given its ID."
+    summary=f"Add or remove connections of a {config['RECORD_ONE_NAME']} " + \
+        "given its ID. Many connections can be given in ids."
 )
-def update_record_one_connections(
+async def update_record_one_connections(
     response: Response, request: Request, id: str,
     record_one_connections: UpdateRecordOneConnections = Body(),
-    current_user: User = Depends(keycloak_services.get_current_user)
+    current_user: User = Depends(keycloak_services.get_current_user),
+    # Read after the user is authenticated
+    record: dict = Depends(record_one_services.load_record_one)
 ):
     record_one_connections = jsonable_encoder(record_one_connections)
+    version = record_one_connections.get("version")
     # Check if the record exists
-    record = record_one_services.get_record_one(id, request)
     if not record:
         raise HTTPException(
             status_code=404,
             detail=f"{config['RECORD_ONE_NAME']} not found"
         )
     # Check if the record is owned or editable by the current user
-    editable = record_one_services.is_editable(
+    editable = await record_one_services.is_editable(
         id, current_user['username'], request)
     if not editable:
         raise HTTPException(
@@ -335,12 +416,38 @@ def update_record_one_connections(
                 f"this operation because the {config['RECORD_ONE_NAME']}" + \
                 " does not belong to you or you are not an editor"
         )
-    record = record_one_services.update_record_one_connections(
+    # Check the connections, all the records to add must exist
+    ids = record_one_services.connection_ids(record_one_connections)
+    if not ids:
+        raise HTTPException(
+            status_code=400,
+            detail='Invalid request body'
+        )
+    if record_one_connections["operation"] == "add":
+        if record_one_connections["type"] != config['RECORD_TWO_NAME']:
+            raise HTTPException(
+                status_code=404,
+                detail='Connection type not found'
+            )
+        titles = await record_two_services.get_titles(ids, request)
+        if any(connection_id not in titles for connection_id in ids):
+            raise HTTPException(
+                status_code=404,
+                detail=f'{config["RECORD_TWO_NAME"]} not found'
+            )
+        record_one_connections["titles"] = titles
+    record = await record_one_services.update_record_one_connections(
         id, record_one_connections, request
     )
     if record:
         response.status_code = 200
         return record
+    elif version is not None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"The {config['RECORD_ONE_NAME']} was modified by " + \
+                "another request, its version is not the given version"
+        )
     else:
         raise HTTPException(
             status_code=500,
@@ -354,7 +461,8 @@ def update_record_one_connections(
         200: {
             "model": RecordOne,
             "description": f"The {config['RECORD_ONE_NAME']} has been" + \
-                " updated successfully"
+                " updated successfully. It is returned without its " + \
+                "content, with its new version"
         },
         400: {
             "description": "Invalid request body"
@@ -367,6 +475,10 @@ def update_record_one_connections(
         404: {
             "description": f"{config['RECORD_ONE_NAME']} not found"
         },
+        409: {
+            "description": f"The {config['RECORD_ONE_NAME']} was modified by " + \
+                "another request, its version is not the given version"
+        },
         500: {
             "description": "There was an error updating the " + \
                 f"{config['RECORD_ONE_NAME']}."
@@ -375,21 +487,23 @@ def update_record_one_connections(
     summary=f"Update the content of a {config['RECORD_ONE_NAME']} " + \
         "given its ID."
 )
-def update_record_one_content(
+async def update_record_one_content(
     response: Response, request: Request, id: str,
     record_one_content: UpdateRecordOneContent = Body(),
-    current_user: User = Depends(keycloak_services.get_current_user)
+    current_user: User = Depends(keycloak_services.get_current_user),
+    # Read after the user is authenticated
+    record: dict = Depends(record_one_services.load_record_one)
 ):
     record_one_content = jsonable_encoder(record_one_content)
+    version = record_one_content.get("version")
     # Check if the record exists
-    record = record_one_services.get_record_one(id, request)
     if not record:
         raise HTTPException(
             status_code=404,
             detail=f"{config['RECORD_ONE_NAME']} not found"
         )
     # Check if the record is owned or editable by the current user
-    editable = record_one_services.is_editable(
+    editable = await record_one_services.is_editable(
         id, current_user['username'], request)
     if not editable:
         raise HTTPException(
@@ -398,12 +512,18 @@ def update_record_one_content(
                 f"this operation because the {config['RECORD_ONE_NAME']}" + \
                 " does not belong to you or you are not an editor"
         )
-    record = record_one_services.update_record_one_content(
+    record = await record_one_services.update_record_one_content(
         id, record_one_content, request
     )
     if record:
         response.status_code = 200
         return record
+    elif version is not None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"The {config['RECORD_ONE_NAME']} was modified by " + \
+                "another request, its version is not the given version"
+        )
     else:
         raise HTTPException(
             status_code=500,
@@ -417,7 +537,8 @@ def update_record_one_content(
         200: {
             "model": RecordOne,
             "description": f"The {config['RECORD_ONE_NAME']} has been" + \
-                " updated successfully"
+                " updated successfully. It is returned without its " + \
+                "content, with its new version"
         },
         400: {
             "description": "Invalid request body"
@@ -439,14 +560,16 @@ def update_record_one_content(
         "given its ID.",
     include_in_schema=config['PUT_RECORD_ONE_ID_CONTENT_CSV'].lower() == "true"
 )
-def update_record_one_content_csv(
+async def update_record_one_content_csv(
     response: Response, request: Request, id: str, file: UploadFile,
-    current_user: User = Depends(keycloak_services.get_current_user)
+    current_user: User = Depends(keycloak_services.get_current_user),
+    # Read after the user is authenticated
+    record: dict = Depends(record_one_services.load_record_one)
 ):
-    def csv_to_dict(file):
+    def csv_to_dict(file_content):
         """Convert a CSV file to a dictionary"""
         # Read the CSV file
-        csv_file = file.read().decode('utf-8').splitlines()
+        csv_file = file_content.decode('utf-8').splitlines()
         # Create a dictionary from the CSV file
         csv_dict = csv.DictReader(csv_file)
         # Convert the CSV file to a dictionary
@@ -454,16 +577,15 @@ def update_record_one_content_csv(
         return csv_dict
 
     # Read CSV from file and convert to dict
-    vsc_content = csv_to_dict(file.file)
+    vsc_content = csv_to_dict(await file.read())
     # Check if the record exists
-    record = record_one_services.get_record_one(id, request)
     if not record:
         raise HTTPException(
             status_code=404,
             detail=f"{config['RECORD_ONE_NAME']} not found"
         )
     # Check if the record is owned or editable by the current user
-    editable = record_one_services.is_editable(
+    editable = await record_one_services.is_editable(
         id, current_user['username'], request)
     if not editable:
         raise HTTPException(
@@ -476,7 +598,7 @@ def update_record_one_content_csv(
         'content': vsc_content,
         'operation': 'add'
     }
-    record = record_one_services.update_record_one_content(
+    record = await record_one_services.update_record_one_content(
         id, record_one_content, request
     )
     if record:
@@ -490,6 +612,42 @@ def update_record_one_content_csv(
         )
 
 
+@router.delete("",
+    responses={
+        200: {
+            "description": f"The {config['RECORD_ONE_TAG']} owned by " + \
+                "you have been deleted, or given to their first editor " + \
+                "if they have editors. The response has the number of " + \
+                "deleted and transferred records and the IDs that were " + \
+                "not found or do not belong to you"
+        },
+        400: {
+            "description": "Too many IDs"
+        },
+        500: {
+            "description": "There was an error deleting the " + \
+                f"{config['RECORD_ONE_TAG']}"
+        }
+    },
+    summary=f"Delete many {config['RECORD_ONE_TAG']} given their IDs."
+)
+async def delete_records_one(
+    request: Request,
+    ids: List[str] = Query(
+        ..., description=f"IDs of the {config['RECORD_ONE_TAG']} to delete"
+    ),
+    current_user: User = Depends(keycloak_services.get_current_user)
+):
+    if len(ids) > max_limit:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many IDs, the maximum is {max_limit}"
+        )
+    return await record_one_services.delete_records_one(
+        ids, current_user['username'], request
+    )
+
+
 @router.delete("/{id}",
     responses={
         204: {
@@ -510,19 +668,20 @@ def update_record_one_content_csv(
     },
     summary=f"Delete a {config['RECORD_ONE_NAME']} given its ID."
 )
-def delete_record_one(
+async def delete_record_one(
     response: Response, request: Request, id: str,
-    current_user: User = Depends(keycloak_services.get_current_user)
+    current_user: User = Depends(keycloak_services.get_current_user),
+    # Read after the user is authenticated
+    record: dict = Depends(record_one_services.load_record_one)
 ):
     # Check if the record exists
-    record = record_one_services.get_record_one(id, request)
     if not record:
         raise HTTPException(
             status_code=404,
             detail=f"{config['RECORD_ONE_NAME']} not found"
         )
     # Check if the record is owned by the current user
-    editable = record_one_services.is_owned(
+    editable = await record_one_services.is_owned(
         id, current_user['username'], request
     )
     if not editable:
@@ -530,8 +689,9 @@ def delete_record_one(
             status_code=403,
             detail='Record not owned by you'
         )
-    deleted = record_one_services.delete_record_one(
-        id, request
+    # The record is deleted only if it is still owned by the current user
+    deleted = await record_one_services.delete_record_one(
+        id, request, owner=current_user['username']
     )
     if deleted:
         response.status_code = 204
@@ -2,12 +2,17 @@ import yaml
 from fastapi import APIRouter, Depends, Body, Response, HTTPException, \
     Request, Query, UploadFile
 from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
 from typing import List
 from dotenv import dotenv_values
 from ..models.user_model import User
 from ..models.record_two_model import RecordTwo, NewRecordTwo, UpdateRecordTwo
-from ..services import keycloak_services, record_two_services
+from ..services import keycloak_services, record_two_services, \
+    streaming_services
+from ..services.user_directory_services import user_directory
+from ..services.pagination_services import default_limit, max_limit
+from ..services.database_services import TitleExistsError
 
 router = APIRouter()
 
@@ -20,7 +25,13 @@ config = dotenv_values(".env")
     responses={
         200: {
             "model": List[RecordTwo],
-            "description": f"List of all {config['RECORD_TWO_TAG']}."
+            "description": f"List of all {config['RECORD_TWO_TAG']}. " + \
+                "The X-Next-Cursor header has the cursor of the next page. " + \
+                "Send Accept: application/x-ndjson to get one record " + \
+                "per line."
+        },
+        400: {
+            "description": "Invalid cursor, or cursor used with search"
         },
         500: {
             "description": "There was an error retrieving the " + \
@@ -29,10 +40,23 @@ config = dotenv_values(".env")
     },
     summary=f"Retrieve a list of all {config['RECORD_TWO_TAG']}."
 )
-def get_records_two(
+async def get_records_two(
     response: Response, request: Request,
     title: str = Query(
-        None, description="Optional - String to search in the title"
+        None, description="Optional - Beginning of the title"
+    ),
+    search: str = Query(
+        None, description="Optional - Words to search in the title and " + \
+            "the description. The records are sorted by relevance and " + \
+            "only the first page is returned"
+    ),
+    limit: int = Query(
+        default_limit, ge=1, le=max_limit,
+        description="Optional - Maximum number of records to return"
+    ),
+    cursor: str = Query(
+        None, description="Optional - Cursor of the page, returned in the " + \
+            "X-Next-Cursor header of the previous page"
     ),
     current_user: User = Depends(keycloak_services.optional_get_current_user)
 ):
@@ -41,7 +65,15 @@ def get_records_two(
         username = current_user['username']
     else:
         username = None
-    return record_two_services.get_records_two(username, title, request)
+    try:
+        records, next_cursor = await record_two_services.get_records_two(
+            username, title, request, limit, cursor, search=search
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Send the records while they are read from the database
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return streaming_services.records_response(records, request, headers)
 
 
 @router.get("/me",
@@ -49,7 +81,12 @@ def get_records_two(
         200: {
             "model": List[RecordTwo],
             "description": f"List of {config['RECORD_TWO_TAG']} " + \
-                "belonging to the current user."
+                "belonging to the current user. The X-Next-Cursor " + \
+                "header has the cursor of the next page. Send Accept: " + \
+                "application/x-ndjson to get one record per line."
+        },
+        400: {
+            "description": "Invalid cursor, or cursor used with search"
         },
         500: {
             "description": "There was an error retrieving the " + \
@@ -59,17 +96,37 @@ def get_records_two(
     summary=f"Retrieve a list of {config['RECORD_TWO_TAG']} " + \
         "belonging to the current user."
 )
-def get_records_two_me(
+async def get_records_two_me(
     response: Response, request: Request,
     title: str = Query(
-        None, description="Optional - String to search in the title"
+        None, description="Optional - Beginning of the title"
+    ),
+    search: str = Query(
+        None, description="Optional - Words to search in the title and " + \
+            "the description. The records are sorted by relevance and " + \
+            "only the first page is returned"
+    ),
+    limit: int = Query(
+        default_limit, ge=1, le=max_limit,
+        description="Optional - Maximum number of records to return"
+    ),
+    cursor: str = Query(
+        None, description="Optional - Cursor of the page, returned in the " + \
+            "X-Next-Cursor header of the previous page"
     ),
     current_user: User = Depends(keycloak_services.get_current_user)
 ):
     response.status_code = 200
-    return record_two_services.get_records_two_me(
-        current_user['username'], title, request
-    )
+    try:
+        records, next_cursor = await record_two_services.get_records_two_me(
+            current_user['username'], title, request, limit, cursor,
+            search=search
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Send the records while they are read from the database
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return streaming_services.records_response(records, request, headers)
 
 
 @router.post("", 
@@ -93,45 +150,41 @@ def get_records_two_me(
     },
     summary=f"Create a new {config['RECORD_TWO_NAME']}."
 )
-def create_record_two(
+async def create_record_two(
     response: Response, request: Request, record_two: NewRecordTwo = Body(),
     current_user: User = Depends(keycloak_services.get_current_user)
 ):
     new_record_two = jsonable_encoder(record_two)
-    # Check if title is unique
-    unique = record_two_services.title_is_unique(
-        new_record_two["title"], request
+    # Check if the editors or viewers are valid users
+    editors = new_record_two.get("editors") or []
+    viewers = new_record_two.get("viewers") or []
+    unknown = await run_in_threadpool(
+        user_directory.find_unknown, editors + viewers
     )
-    if unique:
-        # Check if the editors or viewers are valid users
-        if "editors" in new_record_two and new_record_two["editors"]:
-            for editor in new_record_two["editors"]:
-                if not keycloak_services.user_exists(editor):
-                    raise HTTPException(
-                        status_code=404,
-                        detail='Editor not found'
-                    )
-        if "viewers" in new_record_two and new_record_two["viewers"]:
-            for viewer in new_record_two["viewers"]:
-                if not keycloak_services.user_exists(viewer):
-                    raise HTTPException(
-                        status_code=404,
-                        detail='Viewer not found'
-                    )
-        response.status_code = 201
-        new_record = record_two_services.create_record_two(
-            new_record_two, current_user['username'], request
+    if any(editor in unknown for editor in editors):
+        raise HTTPException(
+            status_code=404,
+            detail='Editor not found'
         )
-        # Convert the _id field to id
-        new_record["id"] = str(new_record["_id"])
-        del new_record["_id"]
-        return new_record
-
-    else:
+    if unknown:
+        raise HTTPException(
+            status_code=404,
+            detail='Viewer not found'
+        )
+    # Create the record, the unique index on the title rejects duplicates
+    new_record = await record_two_services.create_record_two(
+        new_record_two, current_user['username'], request
+    )
+    if new_record is None:
         raise HTTPException(
             status_code=409,
             detail='Title already exists'
         )
+    response.status_code = 201
+    # Convert the _id field to id
+    new_record["id"] = str(new_record["_id"])
+    del new_record["_id"]
+    return new_record
 
 
 @router.post('/yaml', 
@@ -155,47 +208,43 @@ def create_record_two(
     },
     summary=f"Create a new {config['RECORD_TWO_NAME']} with a YAML file."
 )
-def create_record_two_yaml(
+async def create_record_two_yaml(
     response: Response, request: Request, file: UploadFile,
     current_user: User = Depends(keycloak_services.get_current_user)
 ):
     # Decode the new user data
-    file_content = file.file.read()
+    file_content = await file.read()
     new_record_two = yaml.safe_load(file_content)
-    # Check if title is unique
-    unique = record_two_services.title_is_unique(
-        new_record_two["title"], request
+    # Check if the editors or viewers are valid users
+    editors = new_record_two.get("editors") or []
+    viewers = new_record_two.get("viewers") or []
+    unknown = await run_in_threadpool(
+        user_directory.find_unknown, editors + viewers
     )
-    if unique:
-        # Check if the editors or viewers are valid users
-        if "editors" in new_record_two and new_record_two["editors"]:
-            for editor in new_record_two["editors"]:
-                if not keycloak_services.user_exists(editor):
-                    raise HTTPException(
-                        status_code=404,
-                        detail='Editor not found'
-                    )
-        if "viewers" in new_record_two and new_record_two["viewers"]:
-            for viewer in new_record_two["viewers"]:
-                if not keycloak_services.user_exists(viewer):
-                    raise HTTPException(
-                        status_code=404,
-                        detail='Viewer not found'
-                    )
-        response.status_code = 201
-        new_record = record_two_services.create_record_two(
-            new_record_two, current_user['username'], request
+    if any(editor in unknown for editor in editors):
+        raise HTTPException(
+            status_code=404,
+            detail='Editor not found'
         )
-        # Convert the _id field to id
-        new_record["id"] = str(new_record["_id"])
-        del new_record["_id"]
-        return new_record
-
-    else:
+    if unknown:
+        raise HTTPException(
+            status_code=404,
+            detail='Viewer not found'
+        )
+    # Create the record, the unique index on the title rejects duplicates
+    new_record = await record_two_services.create_record_two(
+        new_record_two, current_user['username'], request
+    )
+    if new_record is None:
         raise HTTPException(
             status_code=409,
             detail='Title already exists'
         )
+    response.status_code = 201
+    # Convert the _id field to id
+    new_record["id"] = str(new_record["_id"])
+    del new_record["_id"]
+    return new_record
 
 
 @router.get("/{id}",
@@ -214,10 +263,10 @@ def create_record_two_yaml(
     },
     summary=f"Retrieve a {config['RECORD_TWO_NAME']} given its ID."
 )
-def get_record_two(
+async def get_record_two(
     response: Response, request: Request, id: str
 ):
-    record = record_two_services.get_record_two(id, request)
+    record = await record_two_services.get_record_two(id, request)
     if record:
         response.status_code = 200
         return record
@@ -244,10 +293,10 @@ def get_record_two(
     },
     summary=f"Retrieve a {config['RECORD_TWO_NAME']} given its ID."
 )
-def get_record_two_yaml(
+async def get_record_two_yaml(
     response: Response, request: Request, id: str
 ):
-    record = record_two_services.get_record_two(id, request)
+    record = await record_two_services.get_record_two(id, request)
     if record:
         # Make a yaml file from the record and save it to the temp folder
         with open(f'temp/{id}.yaml', 'w') as yaml_file:
@@ -279,6 +328,11 @@ def get_record_two_yaml(
         404: {
             "description": f"{config['RECORD_TWO_NAME']} not found"
         },
+        409: {
+            "description": f"The {config['RECORD_TWO_NAME']} was modified by " + \
+                "another request, its version is not the given version, " + \
+                "or the title already exists"
+        },
         500: {
             "description": "There was an error updating the " + \
                 f"{config['RECORD_TWO_NAME']}"
@@ -286,21 +340,23 @@ def get_record_two_yaml(
     },
     summary=f"Update a {config['RECORD_TWO_NAME']} given its ID."
 )
-def update_record_two(
+async def update_record_two(
     response: Response, request: Request, id: str,
     record_two: UpdateRecordTwo = Body(),
-    current_user: User = Depends(keycloak_services.get_current_user)
+    current_user: User = Depends(keycloak_services.get_current_user),
+    # Read after the user is authenticated
+    record: dict = Depends(record_two_services.load_record_two)
 ):
     record_two = jsonable_encoder(record_two)
+    version = record_two.get("version")
     # Check if the record exists
-    record = record_two_services.get_record_two(id, request)
     if not record:
         raise HTTPException(
             status_code=404,
             detail=f"{config['RECORD_TWO_NAME']} not found"
         )
     # Check if the record is owned or editable by the current user
-    editable = record_two_services.is_editable(
+    editable = await record_two_services.is_editable(
         id, current_user['username'], request
     )
     if not editable:
@@ -310,12 +366,24 @@ def update_record_two(
                 f"this operation because the {config['RECORD_TWO_NAME']}" + \
                 " does not belong to you or you are not an editor"
         )
-    record = record_two_services.update_record_two(
-        id, record_two, request
-    )
+    try:
+        record = await record_two_services.update_record_two(
+            id, record_two, request
+        )
+    except TitleExistsError:
+        raise HTTPException(
+            status_code=409,
+            detail='Title already exists'
+        )
     if record:
         response.status_code = 200
         return record
+    elif version is not None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"The {config['RECORD_TWO_NAME']} was modified by " + \
+                "another request, its version is not the given version"
+        )
     else:
         raise HTTPException(
             status_code=500,
@@ -324,6 +392,42 @@ def update_record_two(
         )
 
 
+@router.delete("",
+    responses={
+        200: {
+            "description": f"The {config['RECORD_TWO_TAG']} owned by " + \
+                "you have been deleted, or given to their first editor " + \
+                "if they have editors. The response has the number of " + \
+                "deleted and transferred records and the IDs that were " + \
+                "not found or do not belong to you"
+        },
+        400: {
+            "description": "Too many IDs"
+        },
+        500: {
+            "description": "There was an error deleting the " + \
+                f"{config['RECORD_TWO_TAG']}"
+        }
+    },
+    summary=f"Delete many {config['RECORD_TWO_TAG']} given their IDs."
+)
+async def delete_records_two(
+    request: Request,
+    ids: List[str] = Query(
+        ..., description=f"IDs of the {config['RECORD_TWO_TAG']} to delete"
+    ),
+    current_user: User = Depends(keycloak_services.get_current_user)
+):
+    if len(ids) > max_limit:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many IDs, the maximum is {max_limit}"
+        )
+    return await record_two_services.delete_records_two(
+        ids, current_user['username'], request
+    )
+
+
 @router.delete("/{id}",
     responses={
         204: {
@@ -344,19 +448,20 @@ def update_record_two(
     },
     summary=f"Delete a {config['RECORD_TWO_NAME']} given its ID."
 )
-def delete_record_two(
+async def delete_record_two(
     response: Response, request: Request, id: str,
-    current_user: User = Depends(keycloak_services.get_current_user)
+    current_user: User = Depends(keycloak_services.get_current_user),
+    # Read after the user is authenticated
+    record: dict = Depends(record_two_services.load_record_two)
 ):
     # Check if the record exists
-    record = record_two_services.get_record_two(id, request)
     if not record:
         raise HTTPException(
             status_code=404,
             detail=f"{config['RECORD_TWO_NAME']} not found"
         )
     # Check if the record is owned by the current user
-    editable = record_two_services.is_owned(
+    editable = await record_two_services.is_owned(
         id, current_user['username'], request)
     if not editable:
         raise HTTPException(
@@ -365,8 +470,9 @@ def delete_record_two(
                 f"this operation because the {config['RECORD_TWO_NAME']}" + \
                 " does not belong to you"
         )
-    deleted = record_two_services.delete_record_two(
-        id, request
+    # The record is deleted only if it is still owned by the current user
+    deleted = await record_two_services.delete_record_two(
+        id, request, owner=current_user['username']
     )
     if deleted:
         response.status_code = 204
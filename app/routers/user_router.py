@@ -6,7 +6,8 @@ from fastapi.encoders import jsonable_encoder
 from typing import List
 
 from ..models.user_model import NewUser, User, UpdateUser
-from ..services import keycloak_services
+from ..services import keycloak_services, keycloak_async_services
+from ..services.user_directory_services import user_directory
 
 router = APIRouter()
 
@@ -33,7 +34,7 @@ async def create_user(new_user: NewUser, response: Response):
 
     # Create the new user in the keycloak server
     try:
-        status_code = keycloak_services.create_user_keycloak(
+        status_code = await keycloak_async_services.create_user_keycloak(
             username=user['username'],
             first_name=user['first_name'],
             last_name=user['last_name'],
@@ -47,7 +48,10 @@ async def create_user(new_user: NewUser, response: Response):
         )
     if status_code == 201:
         # Get info from user
-        user_info = keycloak_services.get_user_info(user['username'])
+        user_info = await keycloak_async_services.get_user_info(
+            user['username']
+        )
+        user_directory.upsert(user_info)
         response.status_code = 201
         return user_info
     elif status_code == 409:
@@ -85,7 +89,7 @@ async def create_user_yaml(response: Response, file: UploadFile,):
 
     # Create the new user in the keycloak server
     try:
-        status_code = keycloak_services.create_user_keycloak(
+        status_code = await keycloak_async_services.create_user_keycloak(
             username=user['username'],
             first_name=user['first_name'],
             last_name=user['last_name'],
@@ -99,7 +103,10 @@ async def create_user_yaml(response: Response, file: UploadFile,):
         )
     if status_code == 201:
         # Get info from user
-        user_info = keycloak_services.get_user_info(user['username'])
+        user_info = await keycloak_async_services.get_user_info(
+            user['username']
+        )
+        user_directory.upsert(user_info)
         response.status_code = 201
         return user_info
     elif status_code == 409:
@@ -169,8 +176,11 @@ async def delete_user(
             detail=f"You cannot delete the user with id {user_id}"
         )
     # Delete the user from the Keycloak server
-    status_code = keycloak_services.delete_user_keycloak(current_user['id'])
+    status_code = await keycloak_async_services.delete_user_keycloak(
+        current_user['id']
+    )
     if status_code == 204:
+        user_directory.remove(current_user['id'])
         response.status_code = status.HTTP_204_NO_CONTENT
         return response
     else:
@@ -219,7 +229,7 @@ async def update_user(
 
     # Decode the JSON body
     info_encoded = jsonable_encoder(update_info)
-    response_code = keycloak_services.update_user(
+    response_code = await keycloak_async_services.update_user(
         user_id=current_user['id'], new_user_information=info_encoded
     )
     if response_code != 204:
@@ -228,6 +238,7 @@ async def update_user(
             detail="Error occurred while modifying the user"
         )
     else:
+        user_directory.update(current_user['id'], info_encoded)
         response.status_code = 204
         return response
 
@@ -249,14 +260,18 @@ async def update_user(
 )
 async def read_users(
     _: User = Depends(keycloak_services.get_current_user)):
-    # Get all users from the keycloak server
+    # Get all users from the user directory, or from the keycloak server if
+    # the directory is not loaded yet
+    if user_directory.is_loaded():
+        return user_directory.users()
     try:
-        users = keycloak_services.get_all_users()
+        users = await keycloak_async_services.get_all_users()
         if 'error' in users:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail='Error getting the users'
             )
+        user_directory.load(users)
         return users
     except Exception:
         # Check if the current user is the test user
@@ -0,0 +1,92 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    In-process LRU cache where every entry has its own expiry time
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of entries. When the cache is full the least recently
+        used entry is evicted
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the value stored for key, or None if it is missing or expired
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at <= time.time():
+                # The entry is expired, remove it
+                del self._data[key]
+                self.misses += 1
+                return None
+            # Mark the entry as the most recently used
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """
+        Return the value stored for key, or None if it is missing or expired,
+        without changing the hit/miss counters or the order of the entries
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] <= time.time():
+                return None
+            return item[0]
+
+    def set(self, key, value, expires_at: float):
+        """
+        Store value for key until the unix timestamp expires_at
+        """
+        if self.max_size <= 0 or expires_at <= time.time():
+            return
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            # Evict the least recently used entries
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove key from the cache if it is present
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all the entries of the cache
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        Return the size and the hit/miss counters of the cache
+        """
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
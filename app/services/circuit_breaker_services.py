@@ -0,0 +1,116 @@
+import time
+import threading
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is rejected because the circuit is open
+    """
+
+
+class CircuitBreaker:
+    """
+    Stop calling a service after repeated failures. The circuit opens after
+    failure_threshold consecutive failures and every call fails fast while it
+    is open. After reset_timeout seconds the circuit is half open and one
+    call is allowed as a probe: if it succeeds the circuit closes, otherwise
+    it opens again
+
+    Parameters
+    ----------
+    name : str
+        Name of the protected service, used in the error messages
+    failure_threshold : int
+        Consecutive failures that open the circuit
+    reset_timeout : float
+        Seconds that the circuit stays open before a probe is allowed
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self, name: str, failure_threshold: int = 5,
+        reset_timeout: float = 30
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.rejected = 0
+        self.opened_at = None
+        self._state = self.CLOSED
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.time())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == self.OPEN and \
+                now - self.opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def before_call(self):
+        """
+        Check if a call is allowed. Raises CircuitOpenError if it is not
+        """
+        with self._lock:
+            state = self._current_state(time.time())
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probing:
+                # Let this call through as the probe
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f'{self.name} is not available')
+
+    def record_success(self):
+        """
+        Register a successful call, closing the circuit
+        """
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._state = self.CLOSED
+            self.opened_at = None
+
+    def release_probe(self):
+        """
+        Register a call that ended without a result, like a cancelled call.
+        The state does not change, but if the call was the probe, the next
+        call is allowed as a new probe
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        """
+        Register a failed call, opening the circuit if needed
+        """
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self.opened_at = time.time()
+
+    def stats(self) -> dict:
+        """
+        Return the state of the circuit and its counters
+        """
+        with self._lock:
+            now = time.time()
+            return {
+                "state": self._current_state(now),
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "open_for": None if self.opened_at is None else
+                    int(now - self.opened_at),
+            }
@@ -0,0 +1,340 @@
+from dotenv import dotenv_values
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError
+
+#dotenv_values reads the values from the .env file and create a dictionary object
+config = dotenv_values(".env")
+
+BUCKETS = "buckets"
+INLINE = "inline"
+
+# Where the content of the new records is stored: "inline", in the record,
+# or "buckets", in chunks of bucket_size rows in the content collection
+content_storage = (config.get('RECORD_ONE_CONTENT_STORAGE') or INLINE).lower()
+# Number of rows of each bucket
+bucket_size = int(config.get('RECORD_ONE_CONTENT_BUCKET_SIZE') or 1000)
+# Name of the collection with the buckets
+content_collection_name = config.get('RECORD_ONE_CONTENT_NAME') or \
+    f"{config['RECORD_ONE_NAME']}_content"
+
+# Indexes of the content collection that are not used anymore
+obsolete_bucket_indexes = ["record_id_seq_start"]
+
+
+def bucket_indexes() -> list:
+    """
+    Indexes of the content collection
+
+    Returns
+    -------
+    list
+        List of IndexModel
+    """
+    return [
+        # The buckets of a record are read in order of sequence
+        IndexModel(
+            [("record_id", ASCENDING), ("seq", ASCENDING)],
+            name="record_id_seq", unique=True
+        ),
+    ]
+
+
+def uses_buckets(record: dict) -> bool:
+    """
+    Check if the content of a record is stored in buckets
+    """
+    return record.get("content_storage") == BUCKETS
+
+
+def _collection(request):
+    return request.app.async_database[content_collection_name]
+
+
+def _bucket_filter(record_id: str, seq: int) -> dict:
+    return {"record_id": ObjectId(record_id), "seq": seq}
+
+
+def _bucket_positions(start: int, stop: int) -> list:
+    """
+    Split the positions between start and stop by bucket, as (seq, first,
+    last) with the positions of the rows inside the bucket
+    """
+    parts = []
+    position = start
+    while position < stop:
+        seq = position // bucket_size
+        part_stop = min(stop, (seq + 1) * bucket_size)
+        parts.append(
+            (seq, position - seq * bucket_size, part_stop - seq * bucket_size)
+        )
+        position = part_stop
+    return parts
+
+
+async def append_rows(record_id: str, rows: list, start: int, request):
+    """
+    Write rows in the buckets of a record, from the given position. Each row
+    is set at its index in its bucket, so the rows are in their place
+    whatever the order of the writes, and a bucket holds up to bucket_size
+    rows whatever the number of appends. The positions must be reserved
+    first incrementing the content_count of the record, so concurrent
+    appends write in different positions. The positions that are reserved
+    but not written yet are null in the bucket
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    rows: list
+        The rows to write
+    start: int
+        The position of the first row
+    request: Request
+        The request object
+    """
+    parts = _bucket_positions(start, start + len(rows))
+    if not parts:
+        return
+    # Create the buckets that do not exist yet. A new bucket must be an array
+    # before its rows are set by index
+    try:
+        await _collection(request).bulk_write(
+            [
+                UpdateOne(
+                    _bucket_filter(record_id, seq),
+                    {"$setOnInsert": {"rows": []}}, upsert=True
+                )
+                for seq, _, _ in parts
+            ],
+            ordered=False
+        )
+    except BulkWriteError as e:
+        # Two appends can create the same bucket at the same time, the
+        # bucket exists anyway
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+    # Setting an index after the end of the array fills the gap with null
+    offset = start
+    operations = []
+    for seq, first, last in parts:
+        operations.append(UpdateOne(
+            _bucket_filter(record_id, seq),
+            {"$set": {
+                f"rows.{index}": rows[offset - start + index - first]
+                for index in range(first, last)
+            }}
+        ))
+        offset += last - first
+    await _collection(request).bulk_write(operations, ordered=False)
+
+
+async def clear_rows(record_id: str, start: int, stop: int, request):
+    """
+    Set to null the positions of a record between two positions, like the
+    positions of an append that failed. They are skipped when the rows are
+    read, and the next append that reserves them writes them again
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    start: int
+        The position of the first row
+    stop: int
+        The position after the last row
+    request: Request
+        The request object
+    """
+    operations = [
+        UpdateOne(
+            _bucket_filter(record_id, seq),
+            {"$unset": {f"rows.{index}": "" for index in range(first, last)}}
+        )
+        for seq, first, last in _bucket_positions(start, stop)
+    ]
+    if operations:
+        await _collection(request).bulk_write(operations, ordered=False)
+
+
+async def read_rows(
+    record_id: str, request, start: int = 0, stop: int = None) -> list:
+    """
+    Read the rows of a record between two positions, getting only the
+    buckets that have them. The positions that are not written are skipped
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    request: Request
+        The request object
+    start: int
+        The position of the first row
+    stop: int
+        The position after the last row, or None to read until the end
+
+    Returns
+    -------
+    list
+        The rows
+    """
+    if stop is not None and stop <= start:
+        return []
+    seq = {"$gte": start // bucket_size}
+    if stop is not None:
+        seq["$lte"] = (stop - 1) // bucket_size
+    rows = []
+    async for bucket in _collection(request).find(
+        {"record_id": ObjectId(record_id), "seq": seq}, {"seq": 1, "rows": 1}
+    ).sort("seq", ASCENDING):
+        bucket_start = bucket["seq"] * bucket_size
+        rows.extend(
+            row for row in bucket["rows"][
+                max(start - bucket_start, 0):
+                None if stop is None else max(stop - bucket_start, 0)
+            ]
+            if row is not None
+        )
+    return rows
+
+
+async def read_fields(record_id: str, fields: list, request) -> list:
+    """
+    Read only some fields of all the rows of a record
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    fields: list
+        The fields of the rows to read
+    request: Request
+        The request object
+
+    Returns
+    -------
+    list
+        The rows, with only the given fields
+    """
+    rows = []
+    # The projection leaves out the positions that are not written
+    async for bucket in _collection(request).find(
+        {"record_id": ObjectId(record_id)},
+        {f"rows.{field}": 1 for field in fields}
+    ).sort("seq", ASCENDING):
+        rows.extend(row for row in bucket.get("rows", []) if row is not None)
+    return rows
+
+
+async def sample_rows(
+    record_id: str, count: int, number: int, request) -> list:
+    """
+    Read about number rows of a record, taken at regular steps, getting only
+    the buckets that have them. The rows are the same that
+    record_one_services.content_preview_stage takes from inline content
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    count: int
+        The number of rows of the record
+    number: int
+        The number of rows to read
+    request: Request
+        The request object
+
+    Returns
+    -------
+    list
+        The rows
+    """
+    if count <= number:
+        return await read_rows(record_id, request)
+    positions = range(0, count, count // number)
+    buckets = {}
+    async for bucket in _collection(request).find(
+        {
+            "record_id": ObjectId(record_id),
+            "seq": {
+                "$in": sorted({position // bucket_size
+                               for position in positions})
+            }
+        },
+        {"seq": 1, "rows": 1}
+    ):
+        buckets[bucket["seq"]] = bucket["rows"]
+    rows = []
+    for position in positions:
+        bucket = buckets.get(position // bucket_size, [])
+        if position % bucket_size < len(bucket) and \
+                bucket[position % bucket_size] is not None:
+            rows.append(bucket[position % bucket_size])
+    return rows
+
+
+async def delete_rows(record_id: str, request):
+    """
+    Delete all the buckets of a record
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    request: Request
+        The request object
+    """
+    await _collection(request).delete_many({"record_id": ObjectId(record_id)})
+
+
+async def delete_rows_many(record_ids: list, request):
+    """
+    Delete all the buckets of many records
+
+    Parameters
+    ----------
+    record_ids: list
+        The ids of the records
+    request: Request
+        The request object
+    """
+    if record_ids:
+        await _collection(request).delete_many({
+            "record_id": {"$in": [
+                ObjectId(record_id) for record_id in record_ids
+            ]}
+        })
+
+
+async def read_content(record: dict, request, fields: list = None) -> list:
+    """
+    Read the content of a record, from the buckets or from the record
+
+    Parameters
+    ----------
+    record: dict
+        The record, with or without its inline content
+    request: Request
+        The request object
+    fields: list
+        The fields of the rows to read, or None to read all of them
+
+    Returns
+    -------
+    list
+        The rows
+    """
+    if uses_buckets(record):
+        if fields:
+            return await read_fields(record["id"], fields, request)
+        return await read_rows(record["id"], request)
+    if fields:
+        projection = {f"content.{field}": 1 for field in fields}
+    else:
+        projection = {"content": 1}
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    stored = await collection.find_one(
+        {"_id": ObjectId(record["id"])}, projection
+    )
+    return (stored or {}).get("content") or []
@@ -0,0 +1,142 @@
+import time
+import threading
+from dotenv import dotenv_values
+
+
+#dotenv_values reads the values from the .env file and create a dictionary object
+config = dotenv_values(".env")
+
+
+class RecordCounts:
+    """
+    Number of documents of the record collections, kept in memory and
+    refreshed in the background, so the stats do not count the collections
+    on every request. By default the counts are estimated from the metadata
+    of the collections, which does not scan them
+
+    Parameters
+    ----------
+    collection_names : list
+        Names of the collections to count
+    ttl : float
+        Seconds between two refreshes of the counts
+    exact : bool
+        If True, the documents are counted with count_documents, which
+        scans the collections
+    """
+
+    def __init__(
+        self, collection_names: list, ttl: float = 10, exact: bool = False
+    ):
+        self.collection_names = collection_names
+        self.ttl = ttl
+        self.exact = exact
+        self.counted_at = None
+        self.refreshes = 0
+        # False when the last refresh failed
+        self.healthy = True
+        self._counts = {}
+        self._database = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _count(self, collection) -> int:
+        if self.exact:
+            return collection.count_documents({})
+        return collection.estimated_document_count()
+
+    def refresh(self, database=None):
+        """
+        Count the documents of the collections
+        """
+        database = database if database is not None else self._database
+        try:
+            counts = {
+                name: self._count(database[name])
+                for name in self.collection_names
+            }
+        except Exception:
+            self.healthy = False
+            raise
+        with self._lock:
+            self._counts = counts
+            self.counted_at = time.time()
+            self.refreshes += 1
+        self.healthy = True
+
+    def is_expired(self) -> bool:
+        """
+        Check if the counts are older than the ttl, with some margin for the
+        background refresh
+        """
+        return self.counted_at is None or \
+            time.time() - self.counted_at > 2 * self.ttl
+
+    def get(self, database) -> dict:
+        """
+        Return the counts. They are refreshed first if the background
+        refresh is not keeping them up to date
+
+        Parameters
+        ----------
+        database : Database
+            The MongoDB database
+
+        Returns
+        -------
+        counts : dict
+            Dictionary with the collection name as key and the number of
+            documents as value
+        """
+        if self.is_expired():
+            self.refresh(database)
+        with self._lock:
+            return dict(self._counts)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"ERROR:    Unable to count the records. {e}")
+            self._stop.wait(self.ttl)
+
+    def start(self, database):
+        """
+        Start the background refresh
+        """
+        self._database = database
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="record-counts", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background refresh
+        """
+        self._stop.set()
+        self._thread = None
+
+    def stats(self) -> dict:
+        """
+        Return the mode and the age of the counts
+        """
+        return {
+            "exact": self.exact,
+            "refreshes": self.refreshes,
+            "healthy": self.healthy,
+            "age": None if self.counted_at is None else
+                int(time.time() - self.counted_at),
+        }
+
+
+record_counts = RecordCounts(
+    [config["RECORD_ONE_NAME"], config["RECORD_TWO_NAME"]],
+    ttl=float(config.get('STATS_COUNTS_TTL') or 10),
+    exact=(config.get('STATS_EXACT_COUNTS') or 'false').lower() == 'true'
+)
@@ -0,0 +1,152 @@
+from dotenv import dotenv_values
+from pymongo import ASCENDING, TEXT, IndexModel
+from pymongo.errors import PyMongoError
+
+from . import readers_services
+from .content_services import bucket_indexes, content_collection_name, \
+    obsolete_bucket_indexes
+
+#dotenv_values reads the values from the .env file and create a dictionary object
+config = dotenv_values(".env")
+
+
+class TitleExistsError(Exception):
+    """
+    Raised when a record is updated with the title of another record, which
+    the title_unique index rejects
+    """
+
+
+def record_indexes() -> list:
+    """
+    Indexes of the record collections
+
+    Returns
+    -------
+    list
+        List of IndexModel
+    """
+    return [
+        # The title of a record is unique
+        IndexModel([("title", ASCENDING)], name="title_unique", unique=True),
+        # Text search in the title and the description, a word in the title
+        # is more relevant than in the description
+        IndexModel(
+            [("title", TEXT), ("description", TEXT)],
+            name="title_description_text",
+            weights={"title": 10, "description": 1}
+        ),
+        # Who can read the records, used to filter the listings. The _id is
+        # included because the listings are paginated by _id
+        IndexModel(
+            [("readers", ASCENDING), ("_id", ASCENDING)], name="readers_id"
+        ),
+    ]
+
+
+def declared_indexes() -> dict:
+    """
+    Indexes that must exist in the database
+
+    Returns
+    -------
+    dict
+        Dictionary with the collection name as key and the list of
+        IndexModel as value
+    """
+    return {
+        config["RECORD_ONE_NAME"]: record_indexes(),
+        config["RECORD_TWO_NAME"]: record_indexes(),
+        content_collection_name: bucket_indexes(),
+    }
+
+
+def obsolete_indexes() -> dict:
+    """
+    Indexes that are not used anymore and must be dropped, because they
+    reject documents that are valid now
+
+    Returns
+    -------
+    dict
+        Dictionary with the collection name as key and the list of index
+        names as value
+    """
+    return {
+        content_collection_name: obsolete_bucket_indexes,
+    }
+
+
+def ensure_indexes(database) -> dict:
+    """
+    Drop the obsolete indexes, create the declared indexes and check that
+    they exist. Creating an index that already exists does nothing
+
+    Parameters
+    ----------
+    database: Database
+        The MongoDB database
+
+    Returns
+    -------
+    dict
+        Dictionary with the collection name as key and the list of names of
+        the declared indexes that could not be created as value
+    """
+    missing = {}
+    for collection_name, index_names in obsolete_indexes().items():
+        collection = database[collection_name]
+        try:
+            existing = collection.index_information()
+            for index_name in index_names:
+                if index_name in existing:
+                    collection.drop_index(index_name)
+        except PyMongoError as e:
+            print(
+                f"ERROR:    Unable to drop the indexes of {collection_name}."
+                f" {e}"
+            )
+    for collection_name, indexes in declared_indexes().items():
+        collection = database[collection_name]
+        try:
+            collection.create_indexes(indexes)
+        except PyMongoError as e:
+            print(
+                f"ERROR:    Unable to create the indexes of {collection_name}."
+                f" {e}"
+            )
+        # Check that all the indexes exist
+        try:
+            existing = collection.index_information()
+        except PyMongoError:
+            existing = {}
+        not_created = [
+            index.document["name"] for index in indexes
+            if index.document["name"] not in existing
+        ]
+        if not_created:
+            missing[collection_name] = not_created
+    return missing
+
+
+def migrate_readers(database) -> dict:
+    """
+    Compute the readers of the records created before the readers field
+
+    Parameters
+    ----------
+    database: Database
+        The MongoDB database
+
+    Returns
+    -------
+    dict
+        Dictionary with the collection name as key and the number of
+        migrated records as value
+    """
+    return {
+        collection_name: readers_services.migrate(database[collection_name])
+        for collection_name in [
+            config["RECORD_ONE_NAME"], config["RECORD_TWO_NAME"]
+        ]
+    }
@@ -0,0 +1,154 @@
+from bson.objectid import ObjectId
+from pymongo import DeleteOne, UpdateOne
+
+from .readers_services import readers_stage
+
+DELETED = "deleted"
+TRANSFERRED = "transferred"
+
+# Conditions of the records that are deleted and of the records that are
+# given to their first editor
+without_editors = {"$or": [{"editors": None}, {"editors": {"$size": 0}}]}
+with_editors = {"editors.0": {"$exists": True}}
+
+
+def transfer_update() -> list:
+    """
+    Pipeline update that makes the first editor the owner of a record and
+    removes it from the editors, in the same write
+
+    Returns
+    -------
+    list
+        The pipeline
+    """
+    return [
+        {
+            "$set": {
+                "owner": {"$arrayElemAt": ["$editors", 0]},
+                "editors": {"$slice": ["$editors", 1, {"$size": "$editors"}]},
+                "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+            }
+        },
+        # The previous owner can not read the record anymore
+        readers_stage()
+    ]
+
+
+def _owned_filter(record_id, owner: str, condition: dict) -> dict:
+    query = {"_id": record_id, **condition}
+    if owner is not None:
+        query["owner"] = owner
+    return query
+
+
+async def delete_or_transfer(
+    collection, record_id: str, owner: str = None,
+    transfer_first: bool = False) -> tuple:
+    """
+    Delete a record if it has no editors, or give it to its first editor
+    otherwise. Each case is a single conditional write, so the record can
+    not change between the check and the write
+
+    Parameters
+    ----------
+    collection: AsyncIOMotorCollection
+        The MongoDB collection
+    record_id: str
+        The id of the record
+    owner: str
+        The username that must own the record, or None to not check it
+    transfer_first: bool
+        True if the record is expected to have editors, to try the transfer
+        first
+
+    Returns
+    -------
+    tuple
+        DELETED or TRANSFERRED and the record before the write, or None and
+        None if the record does not exist or it is not owned by owner
+    """
+    record_id = ObjectId(record_id)
+
+    async def delete():
+        return await collection.find_one_and_delete(
+            _owned_filter(record_id, owner, without_editors),
+            {"content": 0}
+        )
+
+    async def transfer():
+        return await collection.find_one_and_update(
+            _owned_filter(record_id, owner, with_editors),
+            transfer_update(), {"content": 0}
+        )
+
+    attempts = [(DELETED, delete), (TRANSFERRED, transfer)]
+    if transfer_first:
+        attempts.reverse()
+    for result, attempt in attempts:
+        record = await attempt()
+        if record is not None:
+            return result, record
+    return None, None
+
+
+async def delete_or_transfer_many(
+    collection, record_ids: list, owner: str) -> dict:
+    """
+    Delete or give to their first editor many records in one bulk write.
+    The records are read once to choose the write of each one, and each
+    write keeps its condition, so a record that changed in between is
+    skipped
+
+    Parameters
+    ----------
+    collection: AsyncIOMotorCollection
+        The MongoDB collection
+    record_ids: list
+        The ids of the records
+    owner: str
+        The username that must own the records
+
+    Returns
+    -------
+    dict
+        The ids of the records to delete and to transfer, the ids that were
+        not found or are not owned by owner, and the number of records
+        deleted and transferred
+    """
+    object_ids = [
+        ObjectId(record_id) for record_id in dict.fromkeys(record_ids)
+        if ObjectId.is_valid(record_id)
+    ]
+    plan = {DELETED: [], TRANSFERRED: []}
+    operations = []
+    async for record in collection.find(
+        {"_id": {"$in": object_ids}, "owner": owner}, {"editors": 1}
+    ):
+        if record.get("editors"):
+            plan[TRANSFERRED].append(str(record["_id"]))
+            operations.append(UpdateOne(
+                _owned_filter(record["_id"], owner, with_editors),
+                transfer_update()
+            ))
+        else:
+            plan[DELETED].append(str(record["_id"]))
+            operations.append(DeleteOne(
+                _owned_filter(record["_id"], owner, without_editors)
+            ))
+    found = set(plan[DELETED] + plan[TRANSFERRED])
+    deleted_count = transferred_count = 0
+    if operations:
+        result = await collection.bulk_write(operations, ordered=False)
+        deleted_count = result.deleted_count
+        transferred_count = result.modified_count
+    return {
+        "to_delete": plan[DELETED],
+        "to_transfer": plan[TRANSFERRED],
+        "not_found": [
+            record_id for record_id in dict.fromkeys(record_ids)
+            if record_id not in found
+        ],
+        "deleted": deleted_count,
+        "transferred": transferred_count,
+    }
@@ -0,0 +1,346 @@
+import time
+import asyncio
+import httpx
+from dotenv import dotenv_values
+
+from .keycloak_services import AdminTokenManager, users_page_size, \
+    user_info_from_keycloak_user, circuit_breaker
+
+
+#dotenv_values reads the values from the .env file and create a dictionary object
+config = dotenv_values(".env")
+
+
+class KeycloakAsyncClient(httpx.AsyncClient):
+    """
+    Async client used for all the calls to Keycloak. It reports the result
+    of every request to the circuit breaker shared with keycloak_services
+    """
+
+    async def send(self, request, **kwargs):
+        circuit_breaker.before_call()
+        try:
+            response = await super().send(request, **kwargs)
+        except httpx.HTTPError:
+            circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            # Any other error, like a cancellation when the client
+            # disconnects, must not leave the circuit waiting for a probe
+            circuit_breaker.release_probe()
+            raise
+        if response.status_code >= 500:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+        return response
+
+
+_http_client = None
+
+
+def init_http_client():
+    """
+    Create the shared async HTTP client used for the calls to Keycloak. It is
+    called on the startup of the application
+    """
+    global _http_client
+    if _http_client is None:
+        pool_maxsize = int(config.get('KEYCLOAK_POOL_MAXSIZE') or 20)
+        # The client ignores its own verify and limits when it is given a
+        # transport, so they are set in the transport
+        _http_client = KeycloakAsyncClient(
+            timeout=float(config.get('KEYCLOAK_TIMEOUT') or 10),
+            transport=httpx.AsyncHTTPTransport(
+                # Keycloak uses a self-signed certificate, as in the sync
+                # client
+                verify=False,
+                limits=httpx.Limits(
+                    max_connections=pool_maxsize,
+                    max_keepalive_connections=pool_maxsize,
+                ),
+                retries=int(config.get('KEYCLOAK_RETRIES') or 2)
+            ),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """
+    Close the connections of the shared async HTTP client. It is called on
+    the shutdown of the application
+    """
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    # The lock belongs to the event loop that is being closed
+    admin_token_manager._async_lock = None
+
+
+def http_client() -> httpx.AsyncClient:
+    """
+    Return the shared async HTTP client, creating it if the application has
+    not started it yet
+    """
+    if _http_client is None:
+        return init_http_client()
+    return _http_client
+
+
+class AsyncAdminTokenManager(AdminTokenManager):
+    """
+    Async version of AdminTokenManager. Only one coroutine refreshes the
+    token at a time, the rest of the coroutines wait and use the new token
+    """
+
+    def __init__(self, margin: int = 30):
+        super().__init__(margin)
+        self._async_lock = None
+
+    async def _request_tokens_async(self, data: dict) -> dict:
+        response = await http_client().post(
+            self._url(), data=data, headers=self.token_header
+        )
+        return response.json()
+
+    async def get_token_async(self) -> str:
+        """
+        Return a valid access token of the keycloak admin user
+        """
+        # Fast path, the token is still valid
+        if self._is_valid(time.time()):
+            return self._access_token
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            now = time.time()
+            # Another coroutine may have refreshed the token meanwhile
+            if self._is_valid(now):
+                return self._access_token
+            tokens = None
+            if self._can_refresh(now):
+                tokens = await self._request_tokens_async(
+                    self._refresh_data()
+                )
+                if 'access_token' not in tokens:
+                    # The refresh token is not valid anymore
+                    tokens = None
+            if tokens is None:
+                tokens = await self._request_tokens_async(self._login_data())
+            self._store(tokens, now)
+            return self._access_token
+
+
+admin_token_manager = AsyncAdminTokenManager(
+    margin=int(config.get('KEYCLOAK_ADMIN_TOKEN_MARGIN') or 30)
+)
+
+
+def _users_endpoint() -> str:
+    return f'{config["KEYCLOAK_URL"]}' + \
+        f'/admin/realms/{config["KEYCLOAK_REALM"]}/users'
+
+
+async def get_admin_header_keycloak():
+    """
+    This function is used to get the access token of the keycloak admin user.
+    The token is reused until it is about to expire
+    """
+    token = await admin_token_manager.get_token_async()
+    return {
+        "Content-Type": "application/json",
+        'Authorization': 'Bearer ' + token,
+        "Accept": "*/*",
+        "Accept-Encoding": "gzip, deflate, br"
+    }
+
+
+async def create_user_keycloak(
+    username, first_name, last_name, email, password):
+    """
+    This function is used to create a new user in the keycloak server
+
+    Parameters
+    ----------
+    username : str
+        username of the new user
+    first_name : str
+        first name of the new user
+    last_name : str
+        last name of the new user
+    email : str
+        email of the new user
+    password : str
+        password of the new user
+
+    Returns
+    -------
+    int
+        status code of the request
+    """
+    admin_header = await get_admin_header_keycloak()
+    #user variable is used to store the new user's details
+    user = {
+        'firstName': first_name,
+        'lastName': last_name,
+        'email': email,
+        'enabled': 'true',
+        'username': username,
+        "credentials": [
+            {
+                "type": "password",
+                "value": password,
+                "temporary": False
+            }
+        ]
+    }
+    response = await http_client().post(
+        _users_endpoint(), headers=admin_header, json=user
+    )
+    return response.status_code
+
+
+async def get_user_info(username):
+    """
+    This function is used to get the details of a user in the keycloak server
+
+    Parameters
+    ----------
+    username : str
+        username of the user
+
+    Returns
+    -------
+    return_user : dict
+        details of the user
+    """
+    response = await http_client().get(
+        _users_endpoint(),
+        params={'username': username},
+        headers=await get_admin_header_keycloak()
+    )
+    user = response.json()[0]
+
+    # transform the user info from keycloak to the user info used in the app
+    return_user = {}
+    return_user['id'] = user['id']
+    return_user['username'] = user['username']
+    return_user['email'] = user['email']
+    return_user['first_name'] = user['firstName']
+    return_user['last_name'] = user['lastName']
+    return return_user
+
+
+async def delete_user_keycloak(user_id):
+    """
+    This function is used to delete a user from Keycloak
+
+    Parameters
+    ----------
+    user_id : str
+        id of the user
+
+    Returns
+    -------
+    status_code : int
+        status code of the response
+    """
+    response = await http_client().delete(
+        f'{_users_endpoint()}/{user_id}',
+        headers=await get_admin_header_keycloak()
+    )
+    return response.status_code
+
+
+async def update_user(user_id, new_user_information: dict):
+    """
+    Update user information
+
+    Parameters
+    ----------
+    user_id : str
+        id of the user
+    new_user_information : dict
+        new user information
+
+    Returns
+    -------
+    status_code : int
+        status code of the response
+    """
+    admin_header = await get_admin_header_keycloak()
+    keycloak_endpoint = _users_endpoint()
+
+    # Delete all None values from the new user information
+    new_user_information = {
+        k: v for k, v in new_user_information.items() if v is not None
+    }
+
+    if 'password' in new_user_information:
+        response = await http_client().put(
+            f'{keycloak_endpoint}/{user_id}/reset-password',
+            headers=admin_header,
+            json={
+                "type": "password",
+                "temporary": False,
+                "value": new_user_information['password']
+            }
+        )
+
+        del new_user_information['password']
+
+        if response.status_code != 204:
+            return 500
+
+    if 'first_name' in new_user_information:
+        new_user_information['firstName'] = new_user_information['first_name']
+        del new_user_information['first_name']
+    if 'last_name' in new_user_information:
+        new_user_information['lastName'] = new_user_information['last_name']
+        del new_user_information['last_name']
+    if new_user_information:
+        response = await http_client().put(
+            f'{keycloak_endpoint}/{user_id}', headers=admin_header,
+            json=new_user_information
+        )
+        if response.status_code == 204:
+            return response.status_code
+        else:
+            return 500
+    return 204
+
+
+async def get_all_users():
+    """
+    This function is used to get all users. The users are requested to
+    Keycloak page by page, so the list is not cut at the default page size
+
+    Returns
+    -------
+    users : list
+        list of all users
+    """
+    admin_header = await get_admin_header_keycloak()
+
+    return_users = []
+    first = 0
+    while True:
+        response = await http_client().get(
+            _users_endpoint(), headers=admin_header,
+            params={
+                'first': first,
+                'max': users_page_size,
+                'briefRepresentation': 'true'
+            }
+        )
+        if response.status_code != 200:
+            return {'error': 'Server error'}
+        users = response.json()
+        # Extract the relevant information from the response
+        for user in users:
+            return_users.append(user_info_from_keycloak_user(user))
+        # The last page has less users than the page size
+        if len(users) < users_page_size:
+            return return_users
+        first += users_page_size
@@ -1,9 +1,18 @@
 import json
+import time
+import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from jose import jwt, JWTError
 from dotenv import dotenv_values
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
 
+from .cache_services import TTLCache
+from .circuit_breaker_services import CircuitBreaker
+
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 optional_oauth2_scheme = OAuth2PasswordBearer(
@@ -13,46 +22,435 @@ optional_oauth2_scheme = OAuth2PasswordBearer(
 #dotenv_values reads the values from the .env file and create a dictionary object
 config = dotenv_values(".env")
 
+# Circuit breaker shared by all the calls to Keycloak. When Keycloak fails
+# repeatedly the calls fail fast instead of waiting for the timeout
+circuit_breaker = CircuitBreaker(
+    'Keycloak',
+    failure_threshold=int(config.get('KEYCLOAK_CIRCUIT_FAILURES') or 5),
+    reset_timeout=float(config.get('KEYCLOAK_CIRCUIT_RESET') or 30),
+)
 
-def get_admin_header_keycloak():
+
+class KeycloakSession(requests.Session):
+    """
+    Session used for all the calls to Keycloak. It keeps the connections
+    alive in a pool, sets a default timeout on every request and reports the
+    result of every request to the circuit breaker
+
+    Parameters
+    ----------
+    timeout : float
+        Default timeout in seconds of every request
+    pool_connections : int
+        Number of hosts that keep a connection pool
+    pool_maxsize : int
+        Maximum number of connections kept alive for each host
+    retries : int
+        Number of retries of idempotent requests after a connection error or
+        a 502, 503 or 504 response
+    """
+
+    def __init__(
+        self, timeout: float = 10, pool_connections: int = 4,
+        pool_maxsize: int = 20, retries: int = 2
+    ):
+        super().__init__()
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["GET", "HEAD", "PUT", "DELETE"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+            max_retries=retry,
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        circuit_breaker.before_call()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            # Any other error must not leave the circuit waiting for a probe
+            circuit_breaker.release_probe()
+            raise
+        if response.status_code >= 500:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+        return response
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def init_http_client():
+    """
+    Create the shared HTTP client used for the calls to Keycloak. It is
+    called on the startup of the application
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = KeycloakSession(
+                timeout=float(config.get('KEYCLOAK_TIMEOUT') or 10),
+                pool_connections=int(
+                    config.get('KEYCLOAK_POOL_CONNECTIONS') or 4
+                ),
+                pool_maxsize=int(config.get('KEYCLOAK_POOL_MAXSIZE') or 20),
+                retries=int(config.get('KEYCLOAK_RETRIES') or 2),
+            )
+    return _http_client
+
+
+def close_http_client():
+    """
+    Close the connections of the shared HTTP client. It is called on the
+    shutdown of the application
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
+
+
+def http_client() -> KeycloakSession:
+    """
+    Return the shared HTTP client, creating it if the application has not
+    started it yet
+    """
+    if _http_client is None:
+        return init_http_client()
+    return _http_client
+
+
+# Cache of introspected tokens. The key is the hash of the token and the value
+# is the user_info, stored until the token expires
+token_cache = TTLCache(
+    max_size=int(config.get('KEYCLOAK_TOKEN_CACHE_SIZE') or 1024)
+)
+# Maximum number of seconds that a token is cached, even if it expires later
+token_cache_ttl = int(config.get('KEYCLOAK_TOKEN_CACHE_TTL') or 300)
+
+# Cache of rejected tokens. The value is the number of times that the token
+# was rejected and the time when it can be checked again. The waiting time
+# doubles each time the token is rejected, up to rejected_token_max_ttl
+rejected_token_cache = TTLCache(
+    max_size=int(config.get('KEYCLOAK_REJECTED_TOKEN_CACHE_SIZE') or 4096)
+)
+rejected_token_ttl = int(config.get('KEYCLOAK_REJECTED_TOKEN_TTL') or 30)
+rejected_token_max_ttl = int(
+    config.get('KEYCLOAK_REJECTED_TOKEN_MAX_TTL') or 600
+)
+# Number of validations answered from the cache of rejected tokens
+rejected_token_saves = 0
+_rejected_token_lock = threading.Lock()
+
+
+def _is_rejected(token_key: str) -> bool:
+    """
+    Check if a token was rejected recently and must not be checked again yet
+    """
+    global rejected_token_saves
+    # Every token is checked here, the counters of the cache are not changed
+    # so the accepted tokens do not count as misses
+    rejected = rejected_token_cache.peek(token_key)
+    if rejected is not None and time.time() < rejected[1]:
+        # Validations run in many threads of the threadpool
+        with _rejected_token_lock:
+            rejected_token_saves += 1
+        return True
+    return False
+
+
+def _reject(token_key: str) -> dict:
+    """
+    Remember that a token was rejected and return the credentials error
+    """
+    rejected = rejected_token_cache.peek(token_key)
+    times = 1 if rejected is None else rejected[0] + 1
+    wait = min(rejected_token_ttl * 2 ** (times - 1), rejected_token_max_ttl)
+    now = time.time()
+    # Keep the counter longer than the waiting time, so the next rejection
+    # of the token waits longer
+    rejected_token_cache.set(
+        token_key, (times, now + wait), now + wait + rejected_token_max_ttl
+    )
+    return {'error': 'Could not validate credentials'}
+
+
+def rejected_token_stats() -> dict:
+    """
+    Return the size of the cache of rejected tokens and the number of calls
+    to Keycloak that it saved
+    """
+    stats = rejected_token_cache.stats()
+    stats['saved'] = rejected_token_saves
+    return stats
+
+
+def _token_hash(token: str) -> str:
+    """
+    Return the key used to store a token in the caches
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+# Token validation mode: 'introspect' asks Keycloak for every new token and
+# 'jwks' verifies the token signature locally with the realm public keys
+token_validation = (
+    config.get('KEYCLOAK_TOKEN_VALIDATION') or 'introspect'
+).lower()
+# Minimum number of seconds between two downloads of the realm keys
+jwks_min_refresh = int(config.get('KEYCLOAK_JWKS_MIN_REFRESH') or 30)
+
+# Signing keys of the realm, indexed by kid
+_jwks = {}
+_jwks_fetched_at = 0.0
+_jwks_lock = threading.Lock()
+
+
+def _fetch_jwks():
+    """
+    Download the public signing keys of the realm from Keycloak. The time of
+    the attempt is saved even if it fails, so a Keycloak that is down is not
+    asked again before jwks_min_refresh seconds
+    """
+    global _jwks, _jwks_fetched_at
+    url = f'{config["KEYCLOAK_URL"]}' + \
+        f'/realms/{config["KEYCLOAK_REALM"]}/protocol/openid-connect/certs'
+    _jwks_fetched_at = time.time()
+    response = http_client().get(url, verify=False)
+    response.raise_for_status()
+    _jwks = {
+        key['kid']: key for key in response.json().get('keys', [])
+        if key.get('use', 'sig') == 'sig'
+    }
+
+
+def _get_signing_key(kid: str) -> dict:
+    """
+    Return the public key with the given kid. The realm keys are downloaded
+    again when the kid is unknown, to follow the key rotation of Keycloak
+
+    Parameters
+    ----------
+    kid : str
+        Key id from the header of the token
+
+    Returns
+    -------
+    key : dict
+        The JWK, or None if the realm does not have this key
+    """
+    key = _jwks.get(kid)
+    if key is not None:
+        return key
+    with _jwks_lock:
+        # Another thread may have downloaded the keys meanwhile
+        if kid not in _jwks and \
+                time.time() - _jwks_fetched_at >= jwks_min_refresh:
+            _fetch_jwks()
+        return _jwks.get(kid)
+
+
+def _validate_token_offline(token: str) -> dict:
+    """
+    Validate the signature, expiry, issuer and audience of a token with the
+    realm public keys, without calling Keycloak
+
+    Parameters
+    ----------
+    token : str
+        token of the user
+
+    Returns
+    -------
+    claims : dict
+        claims of the token, or None if the token is not valid
+    """
+    try:
+        header = jwt.get_unverified_header(token)
+    except JWTError:
+        return None
+    key = _get_signing_key(header.get('kid'))
+    if key is None:
+        return None
+
+    issuer = config.get('KEYCLOAK_TOKEN_ISSUER') or \
+        f'{config["KEYCLOAK_URL"]}/realms/{config["KEYCLOAK_REALM"]}'
+    audience = config.get('KEYCLOAK_TOKEN_AUDIENCE')
+    try:
+        return jwt.decode(
+            token,
+            key,
+            algorithms=[key.get('alg', 'RS256')],
+            issuer=issuer,
+            audience=audience,
+            options={'verify_aud': bool(audience), 'verify_at_hash': False}
+        )
+    except JWTError:
+        return None
+
+
+def _user_info_from_claims(claims: dict) -> dict:
+    """
+    Transform the claims of a Keycloak token to the user info used in the app
+    """
+    user_info = {}
+    user_info['id'] = claims['sub']
+    user_info['username'] = claims['preferred_username']
+    user_info['email'] = claims['email']
+    user_info['first_name'] = claims['given_name']
+    user_info['last_name'] = claims['family_name']
+    return user_info
+
+
+class AdminTokenManager:
     """
-    This function is used to get the access token of the keycloak admin user
+    Keep the access token of the keycloak admin user and reuse it until it is
+    about to expire. Only one thread refreshes the token at a time, the rest
+    of the threads wait and use the new token
+
+    Parameters
+    ----------
+    margin : int
+        Seconds before the expiry of the token when it is refreshed
     """
-    # header variable is used to specify the headers of the request
-    header = {
+
+    def __init__(self, margin: int = 30):
+        self.margin = margin
+        self.logins = 0
+        self.refreshes = 0
+        self._access_token = None
+        self._access_expires_at = 0.0
+        self._refresh_token = None
+        self._refresh_expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _url(self):
+        return f'{config["KEYCLOAK_URL"]}' + \
+            '/realms/master/protocol/openid-connect/token'
+
+    # header variable is used to specify the headers of the token requests
+    token_header = {
         "Connection": "keep-alive",
         "Content-Type": "application/x-www-form-urlencoded",
         "Accept": "*/*",
         "Accept-Encoding": "gzip, deflate, br"
     }
-    # admin_user variable is used to specify the keycloak admin user credentials
-    admin_user = {
-        'username': config['KEYCLOAK_ADMIN'],
-        'password': config['KEYCLOAK_ADMIN_PASSWORD'],
-        'grant_type': 'password',
-        'client_id': 'admin-cli',
-        'client_secret': config['KEYCLOAK_ADMIN_SECRET']
-    }
 
-    # url = f'{config["KEYCLOAK_URL"]}:{config["KEYCLOAK_PORT"]}' + \
-    #     '/realms/master/protocol/openid-connect/token'
-    url = f'{config["KEYCLOAK_URL"]}' + \
-        '/realms/master/protocol/openid-connect/token'
+    def _login_data(self) -> dict:
+        self.logins += 1
+        return {
+            'username': config['KEYCLOAK_ADMIN'],
+            'password': config['KEYCLOAK_ADMIN_PASSWORD'],
+            'grant_type': 'password',
+            'client_id': 'admin-cli',
+            'client_secret': config['KEYCLOAK_ADMIN_SECRET']
+        }
 
-    # tokens variable is used to store the access token
-    tokens = json.loads(
-        requests.post(
-            url,
-            data=admin_user,
-            headers=header,
-            verify=False
-        ).content
-    )
+    def _refresh_data(self) -> dict:
+        self.refreshes += 1
+        return {
+            'refresh_token': self._refresh_token,
+            'grant_type': 'refresh_token',
+            'client_id': 'admin-cli',
+            'client_secret': config['KEYCLOAK_ADMIN_SECRET']
+        }
+
+    def _can_refresh(self, now: float) -> bool:
+        return self._refresh_token is not None and \
+            now < self._refresh_expires_at - self.margin
+
+    def _request_tokens(self, data: dict) -> dict:
+        return json.loads(
+            http_client().post(
+                self._url(),
+                data=data,
+                headers=self.token_header,
+                verify=False
+            ).content
+        )
+
+    def _store(self, tokens: dict, now: float):
+        self._access_token = tokens['access_token']
+        self._access_expires_at = now + tokens.get('expires_in', 60)
+        self._refresh_token = tokens.get('refresh_token')
+        self._refresh_expires_at = now + tokens.get('refresh_expires_in', 0)
+
+    def _is_valid(self, now: float) -> bool:
+        return self._access_token is not None and \
+            now < self._access_expires_at - self.margin
+
+    def get_token(self) -> str:
+        """
+        Return a valid access token of the keycloak admin user
+        """
+        # Fast path, the token is still valid
+        if self._is_valid(time.time()):
+            return self._access_token
+        with self._lock:
+            now = time.time()
+            # Another thread may have refreshed the token meanwhile
+            if self._is_valid(now):
+                return self._access_token
+            tokens = None
+            if self._can_refresh(now):
+                tokens = self._request_tokens(self._refresh_data())
+                if 'access_token' not in tokens:
+                    # The refresh token is not valid anymore
+                    tokens = None
+            if tokens is None:
+                tokens = self._request_tokens(self._login_data())
+            self._store(tokens, now)
+            return self._access_token
+
+    def invalidate(self):
+        """
+        Forget the stored tokens, the next call will log in again
+        """
+        with self._lock:
+            self._access_token = None
+            self._refresh_token = None
+
+    def stats(self) -> dict:
+        """
+        Return the number of logins and refreshes done
+        """
+        return {
+            "logins": self.logins,
+            "refreshes": self.refreshes,
+            "expires_in": max(0, int(self._access_expires_at - time.time())),
+        }
 
+
+admin_token_manager = AdminTokenManager(
+    margin=int(config.get('KEYCLOAK_ADMIN_TOKEN_MARGIN') or 30)
+)
+
+
+def get_admin_header_keycloak():
+    """
+    This function is used to get the access token of the keycloak admin user.
+    The token is reused until it is about to expire
+    """
     #return the access token in the header
     return {
         "Content-Type": "application/json",
-        'Authorization': 'Bearer ' + tokens['access_token'],
+        'Authorization': 'Bearer ' + admin_token_manager.get_token(),
         "Accept": "*/*",
         "Accept-Encoding": "gzip, deflate, br"
     }
@@ -103,7 +501,7 @@ def create_user_keycloak(username, first_name, last_name, email, password):
     url = f'{config["KEYCLOAK_URL"]}' + \
         f'/admin/realms/{config["KEYCLOAK_REALM"]}/users'
     #response variable is used to store the status code of the request
-    response = requests.post(url, headers=admin_header, json=user)
+    response = http_client().post(url, headers=admin_header, json=user)
 
     return response.status_code
 
@@ -144,7 +542,7 @@ def user_token_keycloak(username, password):
         f'/realms/{config["KEYCLOAK_REALM"]}/protocol/openid-connect/token'
 
     tokens = json.loads(
-        requests.post(
+        http_client().post(
             url,
             data=payload, headers=headers, verify=False
         ).content
@@ -176,7 +574,7 @@ def get_attribute_keycloak(username):
     url = f'{config["KEYCLOAK_URL"]}' + \
         f'/admin/realms/{config["KEYCLOAK_REALM"]}/users'
     #user_info variable is used to store the details of the user
-    user_info = requests.get(
+    user_info = http_client().get(
         f'{url}?username={username}', headers=get_admin_header_keycloak()
     ).json()[0]
 
@@ -211,7 +609,7 @@ def get_user_info(username):
     url = f'{config["KEYCLOAK_URL"]}' + \
         f'/admin/realms/{config["KEYCLOAK_REALM"]}/users'
     #user variable is used to store the details of the user
-    user = requests.get(
+    user = http_client().get(
         f'{url}?username={username}', headers=get_admin_header_keycloak()
     ).json()[0]
 
@@ -252,6 +650,28 @@ def get_user_info_from_token(token):
         user_info['last_name'] = config['TEST_USERNAME']
         return user_info
 
+    # Check if the token was already introspected
+    token_key = _token_hash(token)
+    user_info = token_cache.get(token_key)
+    if user_info is not None:
+        return dict(user_info)
+    # Check if the token was rejected recently
+    if _is_rejected(token_key):
+        return {'error': 'Could not validate credentials'}
+
+    if token_validation == 'jwks':
+        try:
+            claims = _validate_token_offline(token)
+            if claims is None:
+                return _reject(token_key)
+            user_info = _user_info_from_claims(claims)
+        except Exception:
+            return {'error': 'Server error'}
+        # Cache the user info until the token expires
+        expires_at = min(claims['exp'], time.time() + token_cache_ttl)
+        token_cache.set(token_key, dict(user_info), expires_at)
+        return user_info
+
     # Define headers for the request to the keycloak endpoint
     headers = {
         "Connection": "keep-alive",
@@ -272,7 +692,7 @@ def get_user_info_from_token(token):
 
     try:
         # Send the request to the keycloak endpoint
-        response = requests.post(
+        response = http_client().post(
             keycloak_endpoint, headers=headers, data=payload, verify=False
         )
 
@@ -280,12 +700,15 @@ def get_user_info_from_token(token):
         if response.status_code == 200:
             # Extract the relevant information from the response
             user_keycloak = response.json()
-            user_info = {}
-            user_info['id'] = user_keycloak['sub']
-            user_info['username'] = user_keycloak['preferred_username']
-            user_info['email'] = user_keycloak['email']
-            user_info['first_name'] = user_keycloak['given_name']
-            user_info['last_name'] = user_keycloak['family_name']
+            # Keycloak answers active False for expired or invalid tokens
+            if not user_keycloak.get('active', False):
+                return _reject(token_key)
+            user_info = _user_info_from_claims(user_keycloak)
+            # Cache the user info until the token expires
+            expires_at = min(
+                user_keycloak.get('exp', 0), time.time() + token_cache_ttl
+            )
+            token_cache.set(token_key, dict(user_info), expires_at)
             return user_info
         else:
             return {'error': 'Could not validate credentials'}
@@ -362,7 +785,7 @@ def delete_user_keycloak(user_id):
     keycloak_endpoint = f'{config["KEYCLOAK_URL"]}' + \
         f'/admin/realms/{config["KEYCLOAK_REALM"]}/users'
     # Send a DELETE request to the Keycloak endpoint to delete the user
-    response = requests.delete(
+    response = http_client().delete(
         f'{keycloak_endpoint}/{user_id}', headers=admin_header
     )
 
@@ -400,7 +823,7 @@ def update_user(user_id, new_user_information: dict):
     }
 
     if 'password' in new_user_information:
-        response = requests.put(
+        response = http_client().put(
             f'{keycloak_endpoint}/{user_id}/reset-password',
             headers=admin_header,
             json={
@@ -424,7 +847,7 @@ def update_user(user_id, new_user_information: dict):
         new_user_information['lastName'] = new_user_information['last_name']
         del new_user_information['last_name']
     if new_user_information:
-        response = requests.put(
+        response = http_client().put(
             f'{keycloak_endpoint}/{user_id}', headers=admin_header,
             json=new_user_information
         )
@@ -435,9 +858,77 @@ def update_user(user_id, new_user_information: dict):
     return 204
 
 
+def get_user_by_username(username: str) -> dict:
+    """
+    Look for a user in the keycloak server given the exact username
+
+    Parameters
+    ----------
+    username : str
+        username of the user
+
+    Returns
+    -------
+    user_info : dict
+        details of the user, or None if the user does not exist
+    """
+    keycloak_endpoint = f'{config["KEYCLOAK_URL"]}' + \
+        f'/admin/realms/{config["KEYCLOAK_REALM"]}/users'
+    response = http_client().get(
+        keycloak_endpoint, headers=get_admin_header_keycloak(),
+        params={
+            'username': username,
+            'exact': 'true',
+            'briefRepresentation': 'true'
+        }
+    )
+    response.raise_for_status()
+    # Keycloak stores the usernames in lower case
+    for user in response.json():
+        if user['username'] == username.lower():
+            return user_info_from_keycloak_user(user)
+    return None
+
+
+def user_exists(username: str) -> bool:
+    """
+    Check if a user exists in the keycloak server
+
+    Parameters
+    ----------
+    username : str
+        username of the user
+
+    Returns
+    -------
+    bool
+        True if the user exists, False otherwise
+    """
+    return get_user_by_username(username) is not None
+
+
+def user_info_from_keycloak_user(user: dict) -> dict:
+    """
+    Transform a user representation of the Keycloak admin API to the user
+    info used in the app
+    """
+    user_info = {}
+    user_info['id'] = user['id']
+    user_info['username'] = user['username']
+    user_info['email'] = user.get('email', 'Not provided')
+    user_info['first_name'] = user.get('firstName', 'Not provided')
+    user_info['last_name'] = user.get('lastName', 'Not provided')
+    return user_info
+
+
+# Number of users requested to Keycloak in each page
+users_page_size = int(config.get('KEYCLOAK_USERS_PAGE_SIZE') or 100)
+
+
 def get_all_users():
     """
-    This function is used to get all users
+    This function is used to get all users. The users are requested to
+    Keycloak page by page, so the list is not cut at the default page size
 
     Returns
     -------
@@ -448,27 +939,28 @@ def get_all_users():
     admin_header = get_admin_header_keycloak()
 
     # Define the Keycloak endpoint url
-    # keycloak_endpoint = f'{config["KEYCLOAK_URL"]}:{config["KEYCLOAK_PORT"]}' + \
-    #     f'/admin/realms/{config["KEYCLOAK_REALM"]}/users'
     keycloak_endpoint = f'{config["KEYCLOAK_URL"]}' + \
         f'/admin/realms/{config["KEYCLOAK_REALM"]}/users'
 
-    # Send a GET request to the Keycloak endpoint to get all users
-    response = requests.get(keycloak_endpoint, headers=admin_header)
-
-    # If the response is successful
-    if response.status_code == 200:
-        # Extract the relevant information from the response
+    return_users = []
+    first = 0
+    while True:
+        # Send a GET request to the Keycloak endpoint to get a page of users
+        response = http_client().get(
+            keycloak_endpoint, headers=admin_header,
+            params={
+                'first': first,
+                'max': users_page_size,
+                'briefRepresentation': 'true'
+            }
+        )
+        if response.status_code != 200:
+            return {'error': 'Server error'}
         users = response.json()
-        return_users = []
+        # Extract the relevant information from the response
         for user in users:
-            user_info = {}
-            user_info['id'] = user['id']
-            user_info['username'] = user['username']
-            user_info['email'] = user.get('email', 'Not provided')
-            user_info['first_name'] = user.get('firstName', 'Not provided')
-            user_info['last_name'] = user.get('lastName', 'Not provided')
-            return_users.append(user_info)
-        return return_users
-    else:
-        return {'error': 'Server error'}
+            return_users.append(user_info_from_keycloak_user(user))
+        # The last page has less users than the page size
+        if len(users) < users_page_size:
+            return return_users
+        first += users_page_size
@@ -0,0 +1,81 @@
+import os
+import threading
+from dotenv import dotenv_values
+
+
+#dotenv_values reads the values from the .env file and create a dictionary object
+config = dotenv_values(".env")
+
+
+class LogLineCounter:
+    """
+    Count the lines of a log file that keeps growing. The counter remembers
+    the byte offset that it has read and the lines counted so far, so each
+    call reads only the bytes appended since the previous call. If the file
+    is rotated or truncated, it is counted again from the beginning. A new
+    file is detected by its inode, its size and its first bytes
+
+    Parameters
+    ----------
+    path : str
+        Path of the log file
+    chunk_size : int
+        Number of bytes read at a time
+    """
+
+    def __init__(self, path: str, chunk_size: int = 1024 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self.lines = 0
+        self.resets = 0
+        self._inode = None
+        self._head = b""
+        self._lock = threading.Lock()
+
+    def count(self) -> int:
+        """
+        Return the number of lines of the file
+
+        Raises
+        ------
+        FileNotFoundError
+            If the file does not exist
+        """
+        with self._lock:
+            with open(self.path, "rb") as log_file:
+                status = os.fstat(log_file.fileno())
+                head = log_file.read(64)
+                if status.st_ino != self._inode or \
+                        status.st_size < self.offset or \
+                        head[:len(self._head)] != self._head:
+                    # The file was rotated or truncated
+                    if self._inode is not None:
+                        self.resets += 1
+                    self._inode = status.st_ino
+                    self.offset = 0
+                    self.lines = 0
+                self._head = head
+                log_file.seek(self.offset)
+                while True:
+                    chunk = log_file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    self.lines += chunk.count(b"\n")
+                    self.offset += len(chunk)
+            return self.lines
+
+    def stats(self) -> dict:
+        """
+        Return the bytes and lines counted so far
+        """
+        return {
+            "offset": self.offset,
+            "lines": self.lines,
+            "resets": self.resets,
+        }
+
+
+log_counter = LogLineCounter(
+    config.get('UVICORN_LOG_FILE') or "uvicorn_log.txt"
+)
@@ -0,0 +1,183 @@
+import time
+from starlette.routing import Match
+
+# Upper bounds in seconds of the buckets of the latency histograms
+default_buckets = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Routes that do not count as API requests: the scrapes of the metrics and
+# the static files of the dashboard
+internal_routes = ("/metrics", "/static")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _labels(**labels) -> str:
+    return ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in labels.items()
+    )
+
+
+class Metrics:
+    """
+    Request metrics of this worker: counters by route and status code, the
+    requests in flight and a latency histogram by route. They are only
+    changed from the event loop, so they do not need locks
+
+    Parameters
+    ----------
+    buckets : tuple
+        Upper bounds in seconds of the buckets of the latency histograms
+    """
+
+    def __init__(self, buckets: tuple = default_buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.started_at = time.time()
+        self.in_flight = 0
+        # (method, route, status) -> number of requests
+        self.requests = {}
+        # (method, route) -> [count of each bucket, sum, count]
+        self.latencies = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: float):
+        """
+        Register a finished request
+        """
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.latencies.get((method, route))
+        if histogram is None:
+            histogram = [[0] * len(self.buckets), 0.0, 0]
+            self.latencies[(method, route)] = histogram
+        for position, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                histogram[0][position] += 1
+                break
+        histogram[1] += seconds
+        histogram[2] += 1
+
+    def total(self, exclude: tuple = ()) -> int:
+        """
+        Return the number of finished requests, without the requests of the
+        routes in exclude
+        """
+        return sum(
+            count for (_, route, _), count in self.requests.items()
+            if route not in exclude
+        )
+
+    def prometheus(self) -> str:
+        """
+        Return the metrics in the Prometheus text format
+        """
+        lines = [
+            "# HELP http_requests_total Number of finished HTTP requests.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            labels = _labels(method=method, route=route, status=status)
+            lines.append(f"http_requests_total{{{labels}}} {count}")
+        lines += [
+            "# HELP http_requests_in_flight Number of HTTP requests being " + \
+                "processed.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_request_duration_seconds Latency of the HTTP " + \
+                "requests.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in sorted(self.latencies.items()):
+            bucket_counts, seconds, count = histogram
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _labels(method=method, route=route, le=bound)
+                lines.append(
+                    f"http_request_duration_seconds_bucket{{{labels}}} " + \
+                        f"{cumulative}"
+                )
+            labels = _labels(method=method, route=route, le="+Inf")
+            lines.append(
+                f"http_request_duration_seconds_bucket{{{labels}}} {count}"
+            )
+            labels = _labels(method=method, route=route)
+            lines.append(
+                f"http_request_duration_seconds_sum{{{labels}}} {seconds}"
+            )
+            lines.append(
+                f"http_request_duration_seconds_count{{{labels}}} {count}"
+            )
+        lines += [
+            "# HELP process_start_time_seconds Start time of the worker.",
+            "# TYPE process_start_time_seconds gauge",
+            f"process_start_time_seconds {self.started_at}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def route_path(scope: dict) -> str:
+    """
+    Return the path template of the route of a request, like
+    /record/{id}, so the metrics of all the ids of a route are together
+
+    Parameters
+    ----------
+    scope : dict
+        The ASGI scope of the request
+
+    Returns
+    -------
+    str
+        The path template, or "unmatched" if no route matches
+    """
+    app = scope.get("app")
+    for route in getattr(app, "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that registers the metrics of every HTTP request
+    """
+
+    def __init__(self, app, registry: Metrics = None):
+        self.app = app
+        self.registry = registry if registry is not None else metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        # The route is found before the request is handled, because a mount
+        # changes the path of the scope
+        route = route_path(scope)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.registry.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.registry.in_flight -= 1
+            self.registry.observe(
+                scope["method"], route, status,
+                time.perf_counter() - start
+            )
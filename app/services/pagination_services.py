@@ -0,0 +1,117 @@
+import base64
+import binascii
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from dotenv import dotenv_values
+
+#dotenv_values reads the values from the .env file and create a dictionary object
+config = dotenv_values(".env")
+
+# Number of records returned when the limit is not given
+default_limit = int(config.get('RECORDS_PAGE_LIMIT') or 100)
+# Maximum number of records that can be requested in one page
+max_limit = int(config.get('RECORDS_PAGE_MAX_LIMIT') or 1000)
+
+
+def encode_cursor(record_id: ObjectId) -> str:
+    """
+    Make the opaque cursor that points after the given record
+
+    Parameters
+    ----------
+    record_id: ObjectId
+        The _id of the last record of the page
+
+    Returns
+    -------
+    str
+        The cursor
+    """
+    return base64.urlsafe_b64encode(record_id.binary).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> ObjectId:
+    """
+    Get the _id of the record that a cursor points to
+
+    Parameters
+    ----------
+    cursor: str
+        The cursor
+
+    Returns
+    -------
+    ObjectId
+        The _id of the last record of the previous page
+
+    Raises
+    ------
+    ValueError
+        If the cursor is not valid
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        return ObjectId(base64.urlsafe_b64decode(cursor + padding))
+    except (binascii.Error, InvalidId, TypeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def page_query(query: dict, cursor: str) -> dict:
+    """
+    Add to a query the condition to get the records after the cursor
+
+    Parameters
+    ----------
+    query: dict
+        The MongoDB query
+    cursor: str
+        The cursor, or None for the first page
+
+    Returns
+    -------
+    dict
+        The query for the page
+    """
+    if cursor:
+        return {"$and": [query, {"_id": {"$gt": decode_cursor(cursor)}}]}
+    return query
+
+
+async def page_bounds(
+    collection, query: dict, limit: int, cursor: str) -> tuple:
+    """
+    Find which records belong to a page, reading only their _id, so the page
+    can be streamed knowing already the cursor of the next page
+
+    Parameters
+    ----------
+    collection: AsyncIOMotorCollection
+        The MongoDB collection
+    query: dict
+        The MongoDB query
+    limit: int
+        The maximum number of records of the page
+    cursor: str
+        The cursor of the page, or None for the first page
+
+    Returns
+    -------
+    tuple
+        The query that gets the records of the page, or None if the page is
+        empty, and the cursor of the next page, or None if this is the last
+        page
+    """
+    query = page_query(query, cursor)
+    # Get one _id more than the limit to know if there is a next page
+    ids = [
+        record["_id"] async for record in collection.find(
+            query, {"_id": 1}
+        ).sort("_id", 1).limit(limit + 1)
+    ]
+    if not ids:
+        return None, None
+    next_cursor = None
+    if len(ids) > limit:
+        ids = ids[:limit]
+        next_cursor = encode_cursor(ids[-1])
+    return {"$and": [query, {"_id": {"$lte": ids[-1]}}]}, next_cursor
@@ -1,9 +1,17 @@
 import plotly.graph_objects as go
+from fastapi.concurrency import run_in_threadpool
+
+from . import content_services
 
 # Funtion that, given a record and the x and y axis, returns a plotly figure
 def plot(record, x_axis, y_axis, mode='lines+markers'):
     # Get the data from the record
-    content = record['content']
+    return plot_rows(record['content'], x_axis, y_axis, mode)
+
+
+# Funtion that, given the rows of a content and the x and y axis, returns a
+# plotly figure
+def plot_rows(content, x_axis, y_axis, mode='lines+markers'):
     # The content is a list of dictionaries, each dictionary is a row of the table
     x = []
     y = []
@@ -23,3 +31,12 @@ def plot(record, x_axis, y_axis, mode='lines+markers'):
     # Return the figure
     html_fig = fig.to_html(full_html=False)
     return html_fig
+
+
+# Function that, given a record and the x and y axis, reads only the x and y
+# fields of the content and returns a plotly figure
+async def plot_record(record, x_axis, y_axis, request, mode='lines+markers'):
+    content = await content_services.read_content(
+        record, request, fields=[x_axis, y_axis]
+    )
+    return await run_in_threadpool(plot_rows, content, x_axis, y_axis, mode)
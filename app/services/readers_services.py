@@ -0,0 +1,156 @@
+from pymongo.errors import PyMongoError
+
+# Reader of the records that everybody can read. It can not be a username
+PUBLIC = "*"
+
+# Fields of a record that decide who can read it
+READER_FIELDS = {"owner", "editors", "viewers", "visible"}
+
+
+def is_public(record: dict) -> bool:
+    """
+    Check if everybody can read a record. The records without the visible
+    field are visible
+    """
+    return record.get("visible", True) is True
+
+
+def readers(record: dict) -> list:
+    """
+    Get the readers of a record: its owner, editors and viewers, and PUBLIC
+    if the record is visible
+
+    Parameters
+    ----------
+    record: dict
+        The record
+
+    Returns
+    -------
+    list
+        The readers, without repetitions
+    """
+    names = [record.get("owner")] + (record.get("editors") or []) + \
+        (record.get("viewers") or [])
+    if is_public(record):
+        names.append(PUBLIC)
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def readers_stage() -> dict:
+    """
+    Pipeline update stage that computes the readers of a record from its
+    current owner, editors, viewers and visible fields, the same way as
+    readers
+
+    Returns
+    -------
+    dict
+        The $set stage
+    """
+    return {
+        "$set": {
+            "readers": {
+                "$setUnion": [
+                    {"$cond": [{"$ifNull": ["$owner", False]}, ["$owner"], []]},
+                    {"$ifNull": ["$editors", []]},
+                    {"$ifNull": ["$viewers", []]},
+                    {
+                        "$cond": [
+                            {"$or": [
+                                {"$eq": ["$visible", True]},
+                                {"$eq": [{"$type": "$visible"}, "missing"]}
+                            ]},
+                            [PUBLIC],
+                            []
+                        ]
+                    }
+                ]
+            }
+        }
+    }
+
+
+def set_update(fields: dict):
+    """
+    Make the update that sets the given fields of a record. If the fields
+    change who can read the record, the update is a pipeline that also
+    computes the readers again
+
+    Parameters
+    ----------
+    fields: dict
+        The fields to set
+
+    Returns
+    -------
+    dict or list
+        The MongoDB update
+    """
+    if not fields:
+        return {}
+    if READER_FIELDS.isdisjoint(fields):
+        return {"$set": fields}
+    # The values are literals, their keys are not aggregation expressions
+    return [
+        {"$set": {key: {"$literal": value} for key, value in fields.items()}},
+        readers_stage()
+    ]
+
+
+def read_query(username: str = None) -> dict:
+    """
+    Query of the records that a user can read, or that everybody can read
+    if there is no user
+
+    Parameters
+    ----------
+    username: str
+        The username, or None
+
+    Returns
+    -------
+    dict
+        The MongoDB query
+    """
+    if username:
+        return {"readers": {"$in": [username, PUBLIC]}}
+    return {"readers": PUBLIC}
+
+
+def member_query(username: str) -> dict:
+    """
+    Query of the records where the user is the owner, an editor or a viewer
+    """
+    return {"readers": username}
+
+
+def migrate(collection) -> int:
+    """
+    Give the visible field to the records without it and compute the
+    readers of the records without them. The records that are already
+    migrated are not changed, so it can be run many times
+
+    Parameters
+    ----------
+    collection: Collection
+        The MongoDB collection
+
+    Returns
+    -------
+    int
+        The number of records that got their readers
+    """
+    try:
+        collection.update_many(
+            {"visible": {"$exists": False}}, {"$set": {"visible": True}}
+        )
+        result = collection.update_many(
+            {"readers": {"$exists": False}}, [readers_stage()]
+        )
+    except PyMongoError as e:
+        print(
+            f"ERROR:    Unable to compute the readers of {collection.name}. {e}"
+        )
+        return 0
+    return result.modified_count
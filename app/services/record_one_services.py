@@ -1,34 +1,55 @@
+from fastapi import Request
 from dotenv import dotenv_values
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from . import content_services, readers_services, delete_services
+from .database_services import TitleExistsError
+from .pagination_services import page_bounds
+from .search_services import search_query, check_search_cursor, \
+    text_score_sort
+from .streaming_services import batch_size
 
 #dotenv_values reads the values from the .env file and create a dictionary object
 config = dotenv_values(".env")
 
 
-def title_is_unique(title: str, request) -> bool:
+async def iter_records(cursor, request=None, content_number=None):
     """
-    Check on the MongoDB if the title is unique
+    Convert the ObjectId to string of the records of a MongoDB cursor, while
+    the records are read
 
     Parameters
     ----------
-    title : str
-        The title to check
-    
+    cursor: AsyncIOMotorCursor
+        The MongoDB cursor, or None if there are no records
+    request: Request
+        The request object, needed to read the content stored in buckets
+    content_number: int
+        The number of contents to read from the buckets, or None to not read
+        them
+
     Returns
     -------
-    bool
-        True if the title is unique, False otherwise
+    async generator
+        The records
     """
-    record = request.app.database[
-        config["RECORD_ONE_NAME"]].find_one({"title": title})
-    # If the record is None, the title is unique
-    if record is None:
-        return True
-    else:
-        return False
+    if cursor is None:
+        return
+    async for record in cursor:
+        record["id"] = str(record["_id"])
+        del record["_id"]
+        if content_number is not None and \
+                content_services.uses_buckets(record):
+            record["content"] = await content_services.sample_rows(
+                record["id"], record.get("content_count", 0), content_number,
+                request
+            )
+        yield record
 
 
-def create_record_one(record_one: dict, username: str, request) -> dict:
+async def create_record_one(record_one: dict, username: str, request) -> dict:
     """
     Create a new record
 
@@ -42,117 +63,168 @@ def create_record_one(record_one: dict, username: str, request) -> dict:
     Returns
     -------
     new_record: dict
-        The new record
+        The new record, or None if the title already exists
     """
-    # Add the owner to the record
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    # Add the owner and the first version to the record
     record_one["owner"] = username
-    # Insert the record in the database
-    record = request.app.database[
-        config["RECORD_ONE_NAME"]].insert_one(record_one)
+    record_one["version"] = 0
+    # Add who can read the record
+    record_one["readers"] = readers_services.readers(record_one)
+    rows = None
+    if content_services.content_storage == content_services.BUCKETS:
+        # The content is stored in buckets, out of the record
+        rows = record_one.pop("content", None)
+        if not rows or rows == [{}]:
+            rows = []
+        record_one["content_storage"] = content_services.BUCKETS
+        record_one["content_count"] = len(rows)
+    # Insert the record in the database. The unique index on the title
+    # rejects the record if the title already exists
+    try:
+        record = await collection.insert_one(record_one)
+    except DuplicateKeyError:
+        return None
+    if rows:
+        await content_services.append_rows(
+            str(record.inserted_id), rows, 0, request
+        )
     # Get the record from the database
-    new_record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
+    new_record = await collection.find_one(
         {"_id": record.inserted_id}
     )
+    if rows is not None:
+        new_record["content"] = rows
     return new_record
 
 
-def get_records_one(username, title, request, content_number=3) -> list:
+def content_preview_stage(content_number: int) -> dict:
     """
-    Get all the records
+    Aggregation stage that keeps about content_number rows of the content,
+    taken at regular steps, so the rest of the rows are not sent from MongoDB
+
+    Parameters
+    ----------
+    content_number: int
+        The number of contents to return
+
+    Returns
+    -------
+    dict
+        The $addFields stage
+    """
+    return {
+        "$addFields": {
+            "content": {
+                "$let": {
+                    "vars": {
+                        "length": {"$size": {"$ifNull": ["$content", []]}}
+                    },
+                    "in": {
+                        "$cond": [
+                            {"$gt": ["$$length", content_number]},
+                            # Get the contents at every step
+                            {
+                                "$map": {
+                                    "input": {
+                                        "$range": [
+                                            0,
+                                            "$$length",
+                                            {
+                                                "$toInt": {
+                                                    "$floor": {
+                                                        "$divide": [
+                                                            "$$length",
+                                                            content_number
+                                                        ]
+                                                    }
+                                                }
+                                            }
+                                        ]
+                                    },
+                                    "as": "index",
+                                    "in": {
+                                        "$arrayElemAt": ["$content", "$$index"]
+                                    }
+                                }
+                            },
+                            "$content"
+                        ]
+                    }
+                }
+            }
+        }
+    }
+
+
+async def get_records_one(
+    username, title, request, limit, cursor=None, content_number=3,
+    search=None) -> tuple:
+    """
+    Get a page of the records, sorted by _id
 
     Parameters
     ----------
     username: str
         The username of the owner
     title: str
-        The title of the record
+        The beginning of the title
     request: Request
         The request object
+    limit: int
+        The maximum number of records to return
+    cursor: str
+        The cursor of the page, or None for the first page
     content_number: int
         The number of contents to return
+    search: str
+        Words to search in the title and the description. The records found
+        are sorted by relevance and only the first page is returned
 
     Returns
     -------
-    list
-        The list of records
-    """
-    if username:
-        if title:
-            # Get all records from the database with the owner username or
-            # visible True
-            records = list(request.app.database[config["RECORD_ONE_NAME"]].find(
-                {
-                    "$or": [
-                        {"owner": username},
-                        {"editors": username},
-                        {"viewers": username},
-                        {"visible": True},
-                        {"visible": {"$exists": False}}
-                    ],
-                    "title": {
-                        "$regex": title
-                    }
-                }
-            ))
-        else:
-            # Get all records from the database with the owner username or
-            # visible True or visible is not in the record
-            records = list(request.app.database[config["RECORD_ONE_NAME"]].find(
-                {
-                    "$or": [
-                        {"owner": username},
-                        {"editors": username},
-                        {"viewers": username},
-                        {"visible": True},
-                        {"visible": {"$exists": False}}
-                    ]
-                }
-            ))
-    else:
-        if title:
-            # Get all records from the database with visible True
-            records = list(request.app.database[config["RECORD_ONE_NAME"]].find(
-                {
-                     "$or": [
-                        {"visible": True},
-                        {"visible": {"$exists": False}}
-                    ],
-                    "title": {
-                        "$regex": title
-                    }
-                }
-            ))
-        else:
-            # Get all records from the database with visible True
-            records = list(request.app.database[config["RECORD_ONE_NAME"]].find(
-                {
-                     "$or": [
-                        {"visible": True},
-                        {"visible": {"$exists": False}}
-                    ]
-                }
-            ))
-    # Convert the ObjectId to string
-    for record in records:
-        record["id"] = str(record["_id"])
-        del record["_id"]
-    # Delmaton the content of the records
-    for record in records:
-        # Check if the record has content
-        if record["content"]:
-            # Get how many contents the record has
-            content_len = len(record["content"])
-            if content_len > content_number:
-                # Get the step to get the contents
-                step = content_len // content_number
-                # Get the contents
-                record["content"] = [
-                    record["content"][i] for i in range(0, content_len, step)
-                ]
-    return records
-
-
-def get_record_one(record_id: str, request) -> dict:
+    tuple
+        The records, as an async generator that reads them from MongoDB in
+        batches, and the cursor of the next page, or None if there are no
+        more records
+    """
+    # Get the records that the user can read: the visible ones and the
+    # ones of the owner, editors and viewers
+    query = readers_services.read_query(username)
+    # The title starts with the title string, and the title or the
+    # description have the words of the search
+    query = search_query(query, title, search)
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    if search:
+        check_search_cursor(search, cursor)
+        records = collection.aggregate(
+            [
+                {"$match": query},
+                {"$sort": dict(text_score_sort)},
+                {"$limit": limit},
+                content_preview_stage(content_number)
+            ],
+            batchSize=batch_size
+        )
+        return iter_records(records, request, content_number), None
+    query, next_cursor = await page_bounds(
+        collection, query, limit, cursor
+    )
+    if query is None:
+        return iter_records(None), None
+    # Decimate the content of the records in MongoDB
+    records = collection.aggregate(
+        [
+            {"$match": query},
+            {"$sort": {"_id": 1}},
+            content_preview_stage(content_number)
+        ],
+        batchSize=batch_size
+    )
+    return iter_records(records, request, content_number), next_cursor
+
+
+async def get_record_one(record_id: str, request, content=True) -> dict:
     """
     Get a record
 
@@ -160,123 +232,488 @@ def get_record_one(record_id: str, request) -> dict:
     ----------
     record_id: str
         The id of the record
+    content: bool
+        If False, the content is not read
 
     Returns
     -------
     dict
         The record
     """
-    record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    record = await collection.find_one(
+        {"_id": ObjectId(record_id)}, None if content else {"content": 0}
     )
     if record:
         # Convert the ObjectId to string
         record["id"] = str(record["_id"])
         del record["_id"]
+        if content and content_services.uses_buckets(record):
+            record["content"] = await content_services.read_rows(
+                record["id"], request
+            )
     return record
 
 
-def update_record_one(record_id: str, record_one: dict, request) -> dict:
+async def load_record_one(id: str, request: Request) -> dict:
     """
-    Update a record
+    Dependency that reads the record of the path, without its content, once
+    per request. The record is kept in the request, so the checks and the
+    updates of the same request use it instead of reading it again
+
+    Parameters
+    ----------
+    id: str
+        The id of the record
+    request: Request
+        The request object
+
+    Returns
+    -------
+    dict
+        The record as it was when it was read, or None if it does not exist
+    """
+    record = getattr(request.state, "record_one", None)
+    if record is None or record["id"] != id:
+        record = await get_record_one(id, request, content=False)
+        request.state.record_one = record
+    return record
+
+
+async def uses_buckets(record_id: str, request) -> bool:
+    """
+    Check if the content of a record is stored in buckets
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+
+    Returns
+    -------
+    bool
+        True if the content is stored in buckets, False otherwise
+    """
+    record = await load_record_one(record_id, request)
+    return record is not None and content_services.uses_buckets(record)
+
+
+def record_filter(record_id: str, version: int = None) -> dict:
+    """
+    Make the filter that selects a record, and only if it has the expected
+    version when a version is given
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    version: int
+        The version that the record must have, or None to not check it
+
+    Returns
+    -------
+    dict
+        The MongoDB filter
+    """
+    query = {"_id": ObjectId(record_id)}
+    if version is not None:
+        if version == 0:
+            # Records created before the version field have version 0
+            query["version"] = {"$in": [0, None]}
+        else:
+            query["version"] = version
+    return query
+
+
+async def find_and_update(
+    record_id: str, update, version, request, projection: dict = None) -> dict:
+    """
+    Apply an update to a record in a single round trip and return the record
+    after the update. The version of the record is incremented
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    update: dict or list
+        The MongoDB update
+    version: int
+        The version that the record must have, or None to not check it
+    request: Request
+        The request object
+    projection: dict
+        The fields of the record to return, or None to return all of them
+
+    Returns
+    -------
+    updated_record: dict
+        The updated record, or None if the record does not exist or it does
+        not have the expected version
+
+    Raises
+    ------
+    TitleExistsError
+        If the update gives the record the title of another record
+    """
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    if not update:
+        # Nothing to update, return the record as it is
+        updated_record = await collection.find_one(
+            record_filter(record_id, version), projection
+        )
+    elif isinstance(update, list):
+        # Pipeline update
+        update = update + [
+            {"$set": {"version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}}
+        ]
+    else:
+        update = dict(update, **{"$inc": {"version": 1}})
+    if update:
+        try:
+            updated_record = await collection.find_one_and_update(
+                record_filter(record_id, version), update, projection,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError as e:
+            raise TitleExistsError("Title already exists") from e
+    if updated_record:
+        # Convert the ObjectId to string
+        updated_record["id"] = str(updated_record["_id"])
+        del updated_record["_id"]
+    return updated_record
+
+
+async def update_record_one(record_id: str, record_one: dict, request) -> dict:
+    """
+    Update the given fields of a record
 
     Parameters
     ----------
     record_id: str
         The id of the record
     record_one: dict
-        The record to update
+        The fields to update. The fields with value None are not updated. If
+        it has a version, the record is updated only if it has that version
 
     Returns
     -------
     updated_record: dict
-        The updated record
+        The updated record, or None if the record does not exist or it does
+        not have the expected version
     """
-    # Get the record from the database
-    actual_record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
-    )
-    # Update the actual record with the new values
-    for key, value in record_one.items():
-        if value is not None:
-            actual_record[key] = value
-    del actual_record["_id"]
-    # Update the record in the database
-    request.app.database[config["RECORD_ONE_NAME"]].update_one(
-        {"_id": ObjectId(record_id)},
-        {"$set": actual_record}
-    )
-    updated_record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
+    version = record_one.pop("version", None)
+    # Only the fields with a value are updated
+    fields = {
+        key: value for key, value in record_one.items() if value is not None
+    }
+    if "content" in fields and await uses_buckets(record_id, request):
+        return await replace_record_one_content(
+            record_id, fields, version, request
+        )
+    # The readers are computed again if the permissions change
+    update = readers_services.set_update(fields)
+    return await find_and_update(record_id, update, version, request)
+
+
+async def replace_record_one_content(
+    record_id: str, fields: dict, version: int, request) -> dict:
+    """
+    Update the fields of a record that stores its content in buckets,
+    replacing its buckets with the new content
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    fields: dict
+        The fields to update, with the new content
+    version: int
+        The version that the record must have, or None to not check it
+    request: Request
+        The request object
+
+    Returns
+    -------
+    updated_record: dict
+        The updated record, without the content, or None if the record does
+        not exist or it does not have the expected version
+    """
+    rows = fields.pop("content")
+    fields["content_count"] = len(rows)
+    updated_record = await find_and_update(
+        record_id, readers_services.set_update(fields), version, request
     )
-    # Convert the ObjectId to string
-    updated_record["id"] = str(updated_record["_id"])
-    del updated_record["_id"]
+    if updated_record:
+        await content_services.delete_rows(record_id, request)
+        await content_services.append_rows(record_id, rows, 0, request)
     return updated_record
 
 
-def update_record_one_connections(
+def connection_ids(connection: dict) -> list:
+    """
+    Get the ids of the connections of an update, given in id and in ids,
+    without repetitions
+
+    Parameters
+    ----------
+    connection: dict
+        Connections to be update
+
+    Returns
+    -------
+    list
+        The ids, in the order they were given
+    """
+    ids = [connection.get("id")] + (connection.get("ids") or [])
+    return list(dict.fromkeys(
+        connection_id for connection_id in ids if connection_id
+    ))
+
+
+def remove_connection_stage(connection_id: str) -> dict:
+    """
+    Pipeline update stage that removes the first connection with the given
+    id
+
+    Parameters
+    ----------
+    connection_id: str
+        The id of the connected record
+
+    Returns
+    -------
+    dict
+        The $set stage
+    """
+    connections = {"$ifNull": ["$connections", []]}
+    return {
+        "$set": {
+            "connections": {
+                "$let": {
+                    "vars": {
+                        "index": {
+                            "$indexOfArray": [
+                                {"$ifNull": ["$connections.id", []]},
+                                {"$literal": connection_id}
+                            ]
+                        }
+                    },
+                    "in": {
+                        "$cond": [
+                            {"$lt": ["$$index", 0]},
+                            "$connections",
+                            # Keep the connections at the other positions
+                            {
+                                "$map": {
+                                    "input": {
+                                        "$filter": {
+                                            "input": {"$range": [
+                                                0, {"$size": connections}
+                                            ]},
+                                            "as": "position",
+                                            "cond": {"$ne": [
+                                                "$$position", "$$index"
+                                            ]}
+                                        }
+                                    },
+                                    "as": "position",
+                                    "in": {"$arrayElemAt": [
+                                        connections, "$$position"
+                                    ]}
+                                }
+                            }
+                        ]
+                    }
+                }
+            }
+        }
+    }
+
+
+async def update_record_one_connections(
     record_id: str, connection: dict, request) -> dict:
     """
-    Update the connections of a record
+    Add or remove many connections of a record in one update
 
     Parameters
     ----------
     record_id: str
         The id of the record
     connection: dict
-        Connection to be update
+        Connections to be update. To add connections, it must have in
+        "titles" the title of each connected record by id
     request: Request
         The request object
 
     Returns
     -------
     updated_record: dict
-        The updated record
+        The updated record, or None if the record does not exist or it does
+        not have the expected version
     """
-    # Get the record from the database
-    actual_record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
-    )
-    # Update the actual record with the new values
-    # Get the record of the connection
-    connection_record = request.app.database[connection["type"]].find_one(
-        {"_id": ObjectId(connection["id"])}
-    )
-    # If connection["operation"] is "add" add the connection to the record
+    ids = connection_ids(connection)
+    # If connection["operation"] is "add" add the connections to the record
     if connection["operation"] == "add":
-        actual_record["connections"].append(
-            {
-                "id": connection["id"],
-                "type": connection["type"],
-                "title": connection_record["title"]
+        update = {
+            "$push": {
+                "connections": {
+                    "$each": [
+                        {
+                            "id": connection_id,
+                            "type": connection["type"],
+                            "title": connection["titles"][connection_id]
+                        }
+                        for connection_id in ids
+                    ]
+                }
             }
-        )
-    # If connection["operation"] is "remove" remove the connection from the
-    # record
-    elif connection["operation"] == "remove":
-        for record_connection in actual_record["connections"]:
-            if record_connection["id"] == connection["id"]:
-                actual_record["connections"].remove(record_connection)
-    del actual_record["_id"]
-    # Update the record in the database
-    request.app.database[config["RECORD_ONE_NAME"]].update_one(
-        {"_id": ObjectId(record_id)},
-        {"$set": actual_record}
+        }
+    # If connection["operation"] is "remove" remove the first connection
+    # with each id from the record
+    else:
+        update = [
+            remove_connection_stage(connection_id) for connection_id in ids
+        ]
+    return await find_and_update(
+        record_id, update, connection.get("version"), request
     )
-    updated_record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
+
+
+async def append_record_one_content(
+    record_id: str, rows: list, version: int, request) -> dict:
+    """
+    Append rows to the content of a record with $push in a single write, so
+    the cost of the update depends only on the number of new rows and not on
+    the size of the content. The rows are appended all together or not at
+    all, and always one append after the other. The content is not read
+    back, only the rest of the fields of the record are returned
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    rows: list
+        The rows to append
+    version: int
+        The version that the record must have, or None to not check it
+    request: Request
+        The request object
+
+    Returns
+    -------
+    updated_record: dict
+        The updated record without its content, or None if the record does
+        not exist or it does not have the expected version
+    """
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    query = record_filter(record_id, version)
+    updated_record = await collection.find_one_and_update(
+        dict(query, content={"$type": "array", "$ne": [{}]}),
+        {"$push": {"content": {"$each": rows}}, "$inc": {"version": 1}},
+        {"content": 0}, return_document=ReturnDocument.AFTER
     )
+    if not updated_record:
+        # If the content is [{}] or None, the rows replace it
+        updated_record = await collection.find_one_and_update(
+            dict(query, **{"$or": [{"content": None}, {"content": [{}]}]}),
+            {"$set": {"content": rows}, "$inc": {"version": 1}},
+            {"content": 0}, return_document=ReturnDocument.AFTER
+        )
+    if not updated_record:
+        return None
     # Convert the ObjectId to string
     updated_record["id"] = str(updated_record["_id"])
     del updated_record["_id"]
     return updated_record
 
 
-def update_record_one_content(
+async def release_positions(
+    record_id: str, start: int, number: int, request):
+    """
+    Undo the reservation of the positions of an append that failed: the
+    rows that it wrote are cleared and the content_count of the record is
+    restored if no other append reserved positions after it. Otherwise the
+    positions stay as a gap that is skipped when the rows are read. The
+    version is incremented again, so it never goes back
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    start: int
+        The first reserved position
+    number: int
+        The number of reserved positions
+    request: Request
+        The request object
+    """
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    try:
+        await content_services.clear_rows(
+            record_id, start, start + number, request
+        )
+        await collection.update_one(
+            {"_id": ObjectId(record_id), "content_count": start + number},
+            {"$inc": {"content_count": -number, "version": 1}}
+        )
+    except PyMongoError as e:
+        print(
+            "ERROR:    Unable to release the content positions of " + \
+                f"{record_id}. {e}"
+        )
+
+
+async def append_record_one_buckets(
+    record_id: str, rows: list, version: int, request) -> dict:
+    """
+    Append rows to the content of a record that stores its content in
+    buckets. The positions of the rows are reserved in the record, and the
+    rows are written at those positions only in the buckets that receive
+    them. If the rows can not be written, the reservation is undone
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    rows: list
+        The rows to append
+    version: int
+        The version that the record must have, or None to not check it
+    request: Request
+        The request object
+
+    Returns
+    -------
+    updated_record: dict
+        The updated record, without the content, or None if the record does
+        not exist or it does not have the expected version
+    """
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    record = await collection.find_one_and_update(
+        record_filter(record_id, version),
+        {"$inc": {"content_count": len(rows), "version": 1}},
+        return_document=ReturnDocument.BEFORE
+    )
+    if record is None:
+        return None
+    start = record.get("content_count", 0)
+    try:
+        await content_services.append_rows(record_id, rows, start, request)
+    except Exception:
+        await release_positions(record_id, start, len(rows), request)
+        raise
+    # The record after the update
+    record["content_count"] = start + len(rows)
+    record["version"] = (record.get("version") or 0) + 1
+    record["id"] = str(record["_id"])
+    del record["_id"]
+    return record
+
+
+async def update_record_one_content(
     record_id: str, content: dict, request) -> dict:
     """
-    Update the connections of a record
+    Update the content of a record
 
     Parameters
     ----------
@@ -290,81 +727,108 @@ def update_record_one_content(
     Returns
     -------
     updated_record: dict
-        The updated record
+        The updated record without its content, or None if the record does
+        not exist or it does not have the expected version
     """
-    # Get the record from the database
-    actual_record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
-    )
-    # Update the actual record with the new values
-    # If content["operation"] is "add" add the connection to the record
-    if content["operation"] == "add":
-        # If actual_record["content"] is [{}], remove it.
-        if actual_record["content"] == [{}] or actual_record["content"] is None:
-            actual_record["content"] = []
-        # content["content"] is a list of dictionaries, so we need to add the
-        # dictionaries, not the list
-        for one_content in content["content"]:
-            actual_record["content"].append(one_content)
-    # If content["operation"] is "remove" remove the connection from the
-    # record
-    elif content["operation"] == "remove":
-        pass
-    del actual_record["_id"]
-    # Update the record in the database
-    request.app.database[config["RECORD_ONE_NAME"]].update_one(
-        {"_id": ObjectId(record_id)},
-        {"$set": actual_record}
-    )
-    updated_record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
+    # If content["operation"] is "add" append the rows to the content
+    if content["operation"] == "add" and content["content"]:
+        if await uses_buckets(record_id, request):
+            return await append_record_one_buckets(
+                record_id, content["content"], content.get("version"),
+                request
+            )
+        return await append_record_one_content(
+            record_id, content["content"], content.get("version"), request
+        )
+    # If content["operation"] is "remove" nothing is removed yet
+    return await find_and_update(
+        record_id, {}, content.get("version"), request, {"content": 0}
     )
-    # Convert the ObjectId to string
-    updated_record["id"] = str(updated_record["_id"])
-    del updated_record["_id"]
-    return updated_record
 
 
-def delete_record_one(record_id: str, request) -> dict:
+async def delete_record_one(record_id: str, request, owner=None) -> dict:
     """
-    Delete a record
+    Delete a record, or give it to its first editor if it has editors. The
+    record is checked and changed in the same write
 
     Parameters
     ----------
     record_id: str
         The id of the record
+    owner: str
+        The username that must own the record, or None to not check it
 
     Returns
     -------
     bool
         True if the record is deleted, False otherwise
     """
-    record = request.app.database[
-        config["RECORD_ONE_NAME"]].find_one({"_id": ObjectId(record_id)})
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    # The record read by this request, if it was already read
+    record = await load_record_one(record_id, request)
     # Check if the record exists
     if record is None:
         return False
     else:
-        # Delete the record if there are not editors
-        if record["editors"] is None or len(record["editors"]) == 0:
-            request.app.database[config["RECORD_ONE_NAME"]].delete_one(
-                {"_id": ObjectId(record_id)}
-            )
-        else:
-            # Change the owner of the record to the first editor
-            request.app.database[config["RECORD_ONE_NAME"]].update_one(
-                {"_id": ObjectId(record_id)},
-                {"$set": {"owner": record["editors"][0]}}
-            )
-            # Delete the first editor
-            request.app.database[config["RECORD_ONE_NAME"]].update_one(
-                {"_id": ObjectId(record_id)},
-                {"$pop": {"editors": -1}}
+        # Delete the record if there are not editors, otherwise change the
+        # owner of the record to the first editor
+        result, deleted = await delete_services.delete_or_transfer(
+            collection, record_id, owner,
+            transfer_first=bool(record.get("editors"))
+        )
+        if result == delete_services.DELETED and \
+                content_services.uses_buckets(deleted):
+            await content_services.delete_rows(record_id, request)
+        return result is not None
+
+
+async def delete_records_one(record_ids: list, owner: str, request) -> dict:
+    """
+    Delete many records of an owner, or give them to their first editor if
+    they have editors, in one bulk write
+
+    Parameters
+    ----------
+    record_ids: list
+        The ids of the records
+    owner: str
+        The username of the owner
+
+    Returns
+    -------
+    dict
+        The number of records deleted and transferred, and the ids that were
+        not found or are not owned by the owner
+    """
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    result = await delete_services.delete_or_transfer_many(
+        collection, record_ids, owner
+    )
+    if result["deleted"]:
+        # Delete the buckets of the records that do not exist anymore
+        existing = {
+            str(record["_id"]) async for record in collection.find(
+                {"_id": {"$in": [
+                    ObjectId(record_id) for record_id in result["to_delete"]
+                ]}},
+                {"_id": 1}
             )
-        return True
+        }
+        await content_services.delete_rows_many(
+            [
+                record_id for record_id in result["to_delete"]
+                if record_id not in existing
+            ],
+            request
+        )
+    return {
+        "deleted": result["deleted"],
+        "transferred": result["transferred"],
+        "not_found": result["not_found"],
+    }
 
 
-def is_editable(record_id: str, username: str, request) -> bool:
+async def is_editable(record_id: str, username: str, request) -> bool:
     """
     Check if the record is editable
 
@@ -380,9 +844,8 @@ def is_editable(record_id: str, username: str, request) -> bool:
     bool
         True if the record is editable, False otherwise
     """
-    record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
-    )
+    # The record read by this request, if it was already read
+    record = await load_record_one(record_id, request)
     # Check if the record exists
     if record is None:
         return False
@@ -397,7 +860,7 @@ def is_editable(record_id: str, username: str, request) -> bool:
             return False
 
 
-def is_owned(record_id: str, username: str, request) -> bool:
+async def is_owned(record_id: str, username: str, request) -> bool:
     """
     Check if the record is owned
 
@@ -413,9 +876,8 @@ def is_owned(record_id: str, username: str, request) -> bool:
     bool
         True if the record is owned, False otherwise
     """
-    record = request.app.database[config["RECORD_ONE_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
-    )
+    # The record read by this request, if it was already read
+    record = await load_record_one(record_id, request)
     # Check if the record exists
     if record is None:
         return False
@@ -426,51 +888,48 @@ def is_owned(record_id: str, username: str, request) -> bool:
         return False
 
 
-def get_records_one_me(username, title, request) -> list:
+async def get_records_one_me(
+    username, title, request, limit, cursor=None, search=None) -> tuple:
     """
-    Get all the records of the user
+    Get a page of the records of the user, sorted by _id
 
     Parameters
     ----------
     username: str
         The username of the owner, editor or viewer
     title: str
-        String to search in the title
+        The beginning of the title
+    limit: int
+        The maximum number of records to return
+    cursor: str
+        The cursor of the page, or None for the first page
+    search: str
+        Words to search in the title and the description. The records found
+        are sorted by relevance and only the first page is returned
 
     Returns
     -------
-    list
-        The list of records
-    """
-    if title:
-        # Get the records of the owner, editor or viewer with the title
-        records = list(request.app.database[config["RECORD_ONE_NAME"]].find(
-            {
-                "$and": [
-                    {
-                        "$or": [
-                            {"owner": username},
-                            {"editors": username},
-                            {"viewers": username}
-                        ]
-                    },
-                    {"title": {"$regex": title}}
-                ]
-            }
-        ))
-    else:
-        # Get the records of the owner, editor or viewer
-        records = list(request.app.database[config["RECORD_ONE_NAME"]].find(
-            {
-                "$or": [
-                    {"owner": username},
-                    {"editors": username},
-                    {"viewers": username}
-                ]
-            }
-        ))
-    # Convert the ObjectId to string
-    for record in records:
-        record["id"] = str(record["_id"])
-        del record["_id"]
-    return records
+    tuple
+        The records, as an async generator that reads them from MongoDB in
+        batches, and the cursor of the next page, or None if there are no
+        more records
+    """
+    # Get the records of the owner, editor or viewer
+    query = readers_services.member_query(username)
+    # The title starts with the title string, and the title or the
+    # description have the words of the search
+    query = search_query(query, title, search)
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    if search:
+        check_search_cursor(search, cursor)
+        records = collection.find(query).sort(text_score_sort).limit(
+            limit
+        ).batch_size(batch_size)
+        return iter_records(records), None
+    query, next_cursor = await page_bounds(
+        collection, query, limit, cursor
+    )
+    if query is None:
+        return iter_records(None), None
+    records = collection.find(query).sort("_id", 1).batch_size(batch_size)
+    return iter_records(records), next_cursor
@@ -1,34 +1,44 @@
+from fastapi import Request
 from dotenv import dotenv_values
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from . import readers_services, delete_services
+from .database_services import TitleExistsError
+from .pagination_services import page_bounds
+from .search_services import search_query, check_search_cursor, \
+    text_score_sort
+from .streaming_services import batch_size
 
 #dotenv_values reads the values from the .env file and create a dictionary object
 config = dotenv_values(".env")
 
 
-def title_is_unique(title: str, request) -> bool:
+async def iter_records(cursor):
     """
-    Check on the MongoDB if the title is unique
+    Convert the ObjectId to string of the records of a MongoDB cursor, while
+    the records are read
 
     Parameters
     ----------
-    title : str
-        The title to check
-    
+    cursor: AsyncIOMotorCursor
+        The MongoDB cursor, or None if there are no records
+
     Returns
     -------
-    bool
-        True if the title is unique, False otherwise
+    async generator
+        The records
     """
-    record = request.app.database[
-        config["RECORD_TWO_NAME"]].find_one({"title": title})
-    # If the record is None, the title is unique
-    if record is None:
-        return True
-    else:
-        return False
+    if cursor is None:
+        return
+    async for record in cursor:
+        record["id"] = str(record["_id"])
+        del record["_id"]
+        yield record
 
 
-def create_record_two(record_two: dict, username: str, request) -> dict:
+async def create_record_two(record_two: dict, username: str, request) -> dict:
     """
     Create a new record
 
@@ -42,107 +52,82 @@ def create_record_two(record_two: dict, username: str, request) -> dict:
     Returns
     -------
     new_record: dict
-        The new record
+        The new record, or None if the title already exists
     """
+    collection = request.app.async_database[config["RECORD_TWO_NAME"]]
     # Add the visible field to the record with the default value True
     # if it is not present
     if "visible" not in record_two:
         record_two["visible"] = True
-    # Add the owner to the record
+    # Add the owner and the first version to the record
     record_two["owner"] = username
-    # Insert the record in the database
-    record = request.app.database[
-        config["RECORD_TWO_NAME"]].insert_one(record_two)
+    record_two["version"] = 0
+    # Add who can read the record
+    record_two["readers"] = readers_services.readers(record_two)
+    # Insert the record in the database. The unique index on the title
+    # rejects the record if the title already exists
+    try:
+        record = await collection.insert_one(record_two)
+    except DuplicateKeyError:
+        return None
     # Get the record from the database
-    new_record = request.app.database[config["RECORD_TWO_NAME"]].find_one(
+    new_record = await collection.find_one(
         {"_id": record.inserted_id}
     )
     return new_record
 
 
-def get_records_two(username, title, request) -> list:
+async def get_records_two(
+    username, title, request, limit, cursor=None, search=None) -> tuple:
     """
-    Get all the records
+    Get a page of the records, sorted by _id
 
     Parameters
     ----------
     username: str
         The username of the owner
     title: str
-        The title to search in the title
+        The beginning of the title
     request: Request
         The request object
+    limit: int
+        The maximum number of records to return
+    cursor: str
+        The cursor of the page, or None for the first page
+    search: str
+        Words to search in the title and the description. The records found
+        are sorted by relevance and only the first page is returned
 
     Returns
     -------
-    list
-        The list of records
+    tuple
+        The records, as an async generator that reads them from MongoDB in
+        batches, and the cursor of the next page, or None if there are no
+        more records
     """
-    if username:
-        if title:
-            # Get all records from the database with the owner username or visible
-            # True and the title contains the title string or visible is not
-            # present
-            records = list(request.app.database[config["RECORD_TWO_NAME"]].find(
-                {
-                    "$or": [
-                        {"owner": username},
-                        {"editors": username},
-                        {"viewers": username},
-                        {"visible": True},
-                        {"visible": {"$exists": False}}
-                    ],
-                    "title": {
-                        "$regex": title
-                    }
-                }
-            ))
-        else:
-            # Get all records from the database with the owner username or visible
-            # True
-            records = list(request.app.database[config["RECORD_TWO_NAME"]].find(
-                {
-                    "$or": [
-                        {"owner": username},
-                        {"editors": username},
-                        {"viewers": username},
-                        {"visible": True},
-                        {"visible": {"$exists": False}}
-                    ]
-                }
-            ))
-    else:
-        if title:
-            # Get all records from the database with visible True
-            records = list(request.app.database[config["RECORD_TWO_NAME"]].find(
-                {
-                    "$or": [
-                        {"visible": True},
-                        {"visible": {"$exists": False}}
-                    ],
-                    "title": {
-                        "$regex": title
-                    }
-                }
-            ))
-        else:
-            # Get all records from the database with visible True
-            records = list(request.app.database[config["RECORD_TWO_NAME"]].find(
-                {
-                    "$or": [
-                        {"visible": True},
-                        {"visible": {"$exists": False}}
-                    ]
-                }
-            ))
-    # Convert the ObjectId to string
-    for record in records:
-        record["id"] = str(record["_id"])
-        del record["_id"]
-    return records
+    # Get the records that the user can read: the visible ones and the
+    # ones of the owner, editors and viewers
+    query = readers_services.read_query(username)
+    # The title starts with the title string, and the title or the
+    # description have the words of the search
+    query = search_query(query, title, search)
+    collection = request.app.async_database[config["RECORD_TWO_NAME"]]
+    if search:
+        check_search_cursor(search, cursor)
+        records = collection.find(query).sort(text_score_sort).limit(
+            limit
+        ).batch_size(batch_size)
+        return iter_records(records), None
+    query, next_cursor = await page_bounds(
+        collection, query, limit, cursor
+    )
+    if query is None:
+        return iter_records(None), None
+    records = collection.find(query).sort("_id", 1).batch_size(batch_size)
+    return iter_records(records), next_cursor
 
 
-def get_record_two(record_id: str, request) -> dict:
+async def get_record_two(record_id: str, request, content=True) -> dict:
     """
     Get a record
 
@@ -150,14 +135,17 @@ def get_record_two(record_id: str, request) -> dict:
     ----------
     record_id: str
         The id of the record
+    content: bool
+        If False, the content is not read
 
     Returns
     -------
     dict
         The record
     """
-    record = request.app.database[config["RECORD_TWO_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
+    collection = request.app.async_database[config["RECORD_TWO_NAME"]]
+    record = await collection.find_one(
+        {"_id": ObjectId(record_id)}, None if content else {"content": 0}
     )
     if record:
         # Convert the ObjectId to string
@@ -166,85 +154,203 @@ def get_record_two(record_id: str, request) -> dict:
     return record
 
 
-def update_record_two(record_id: str, record_two: dict, request) -> dict:
+async def get_titles(record_ids: list, request) -> dict:
     """
-    Update a record
+    Get the titles of many records in one query, reading only their _id and
+    title
+
+    Parameters
+    ----------
+    record_ids: list
+        The ids of the records
+
+    Returns
+    -------
+    dict
+        Dictionary with the id as key and the title as value, only for the
+        records that exist
+    """
+    collection = request.app.async_database[config["RECORD_TWO_NAME"]]
+    object_ids = [
+        ObjectId(record_id) for record_id in set(record_ids)
+        if ObjectId.is_valid(record_id)
+    ]
+    if not object_ids:
+        return {}
+    return {
+        str(record["_id"]): record["title"]
+        async for record in collection.find(
+            {"_id": {"$in": object_ids}}, {"_id": 1, "title": 1}
+        )
+    }
+
+
+async def load_record_two(id: str, request: Request) -> dict:
+    """
+    Dependency that reads the record of the path, without its content, once
+    per request. The record is kept in the request, so the checks and the
+    updates of the same request use it instead of reading it again
+
+    Parameters
+    ----------
+    id: str
+        The id of the record
+    request: Request
+        The request object
+
+    Returns
+    -------
+    dict
+        The record as it was when it was read, or None if it does not exist
+    """
+    record = getattr(request.state, "record_two", None)
+    if record is None or record["id"] != id:
+        record = await get_record_two(id, request, content=False)
+        request.state.record_two = record
+    return record
+
+
+def record_filter(record_id: str, version: int = None) -> dict:
+    """
+    Make the filter that selects a record, and only if it has the expected
+    version when a version is given
+
+    Parameters
+    ----------
+    record_id: str
+        The id of the record
+    version: int
+        The version that the record must have, or None to not check it
+
+    Returns
+    -------
+    dict
+        The MongoDB filter
+    """
+    query = {"_id": ObjectId(record_id)}
+    if version is not None:
+        if version == 0:
+            # Records created before the version field have version 0
+            query["version"] = {"$in": [0, None]}
+        else:
+            query["version"] = version
+    return query
+
+
+async def update_record_two(record_id: str, record_two: dict, request) -> dict:
+    """
+    Update the given fields of a record in a single round trip
 
     Parameters
     ----------
     record_id: str
         The id of the record
     record_two: dict
-        The record to update
+        The fields to update. The fields with value None are not updated. If
+        it has a version, the record is updated only if it has that version
 
     Returns
     -------
     updated_record: dict
-        The updated record
+        The updated record, or None if the record does not exist or it does
+        not have the expected version
+
+    Raises
+    ------
+    TitleExistsError
+        If the update gives the record the title of another record
     """
-    # Get the record from the database
-    actual_record = request.app.database[config["RECORD_TWO_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
-    )
-    # Update the actual record with the new values
-    for key, value in record_two.items():
-        if value is not None:
-            actual_record[key] = value
-    del actual_record["_id"]
-    # Update the record in the database
-    request.app.database[config["RECORD_TWO_NAME"]].update_one(
-        {"_id": ObjectId(record_id)},
-        {"$set": actual_record}
-    )
-    updated_record = request.app.database[config["RECORD_TWO_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
-    )
-    # Convert the ObjectId to string
-    updated_record["id"] = str(updated_record["_id"])
-    del updated_record["_id"]
+    collection = request.app.async_database[config["RECORD_TWO_NAME"]]
+    version = record_two.pop("version", None)
+    # Only the fields with a value are updated
+    fields = {
+        key: value for key, value in record_two.items() if value is not None
+    }
+    # The readers are computed again if the permissions change
+    update = readers_services.set_update(fields)
+    if isinstance(update, list):
+        update.append(
+            {"$set": {"version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}}
+        )
+    else:
+        update["$inc"] = {"version": 1}
+    try:
+        updated_record = await collection.find_one_and_update(
+            record_filter(record_id, version), update,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError as e:
+        raise TitleExistsError("Title already exists") from e
+    if updated_record:
+        # Convert the ObjectId to string
+        updated_record["id"] = str(updated_record["_id"])
+        del updated_record["_id"]
     return updated_record
 
 
-def delete_record_two(record_id: str, request) -> dict:
+async def delete_record_two(record_id: str, request, owner=None) -> dict:
     """
-    Delete a record
+    Delete a record, or give it to its first editor if it has editors. The
+    record is checked and changed in the same write
 
     Parameters
     ----------
     record_id: str
         The id of the record
+    owner: str
+        The username that must own the record, or None to not check it
 
     Returns
     -------
     bool
         True if the record is deleted, False otherwise
     """
-    record = request.app.database[
-        config["RECORD_TWO_NAME"]].find_one({"_id": ObjectId(record_id)})
+    collection = request.app.async_database[config["RECORD_TWO_NAME"]]
+    # The record read by this request, if it was already read
+    record = await load_record_two(record_id, request)
     # Check if the record exists
     if record is None:
         return False
     else:
-        # Delete the record if there are not editors
-        if record["editors"] is None or len(record["editors"]) == 0:
-            request.app.database[config["RECORD_TWO_NAME"]].delete_one(
-                {"_id": ObjectId(record_id)}
-            )
-        else:
-            # Change the owner of the record to the first editor
-            request.app.database[config["RECORD_TWO_NAME"]].update_one(
-                {"_id": ObjectId(record_id)},
-                {"$set": {"owner": record["editors"][0]}}
-            )
-            # Delete the first editor
-            request.app.database[config["RECORD_TWO_NAME"]].update_one(
-                {"_id": ObjectId(record_id)},
-                {"$pop": {"editors": -1}}
-            )
-        return True
+        # Delete the record if there are not editors, otherwise change the
+        # owner of the record to the first editor
+        result, _ = await delete_services.delete_or_transfer(
+            collection, record_id, owner,
+            transfer_first=bool(record.get("editors"))
+        )
+        return result is not None
+
+
+async def delete_records_two(record_ids: list, owner: str, request) -> dict:
+    """
+    Delete many records of an owner, or give them to their first editor if
+    they have editors, in one bulk write
+
+    Parameters
+    ----------
+    record_ids: list
+        The ids of the records
+    owner: str
+        The username of the owner
+
+    Returns
+    -------
+    dict
+        The number of records deleted and transferred, and the ids that were
+        not found or are not owned by the owner
+    """
+    collection = request.app.async_database[config["RECORD_TWO_NAME"]]
+    result = await delete_services.delete_or_transfer_many(
+        collection, record_ids, owner
+    )
+    return {
+        "deleted": result["deleted"],
+        "transferred": result["transferred"],
+        "not_found": result["not_found"],
+    }
 
 
-def is_editable(record_id: str, username: str, request) -> bool:
+async def is_editable(record_id: str, username: str, request) -> bool:
     """
     Check if the record is editable
 
@@ -260,9 +366,8 @@ def is_editable(record_id: str, username: str, request) -> bool:
     bool
         True if the record is editable, False otherwise
     """
-    record = request.app.database[config["RECORD_TWO_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
-    )
+    # The record read by this request, if it was already read
+    record = await load_record_two(record_id, request)
     # Check if the record exists
     if record is None:
         return False
@@ -277,7 +382,7 @@ def is_editable(record_id: str, username: str, request) -> bool:
             return False
 
 
-def is_owned(record_id: str, username: str, request) -> bool:
+async def is_owned(record_id: str, username: str, request) -> bool:
     """
     Check if the record is owned
 
@@ -293,9 +398,8 @@ def is_owned(record_id: str, username: str, request) -> bool:
     bool
         True if the record is owned, False otherwise
     """
-    record = request.app.database[config["RECORD_TWO_NAME"]].find_one(
-        {"_id": ObjectId(record_id)}
-    )
+    # The record read by this request, if it was already read
+    record = await load_record_two(record_id, request)
     # Check if the record exists
     if record is None:
         return False
@@ -306,51 +410,48 @@ def is_owned(record_id: str, username: str, request) -> bool:
         return False
 
 
-def get_records_two_me(username, title, request) -> list:
+async def get_records_two_me(
+    username, title, request, limit, cursor=None, search=None) -> tuple:
     """
-    Get all the records of the user
+    Get a page of the records of the user, sorted by _id
 
     Parameters
     ----------
     username: str
         The username of the owner, editor or viewer
     title: str
-        String to search in the title
+        The beginning of the title
+    limit: int
+        The maximum number of records to return
+    cursor: str
+        The cursor of the page, or None for the first page
+    search: str
+        Words to search in the title and the description. The records found
+        are sorted by relevance and only the first page is returned
 
     Returns
     -------
-    list
-        The list of records
+    tuple
+        The records, as an async generator that reads them from MongoDB in
+        batches, and the cursor of the next page, or None if there are no
+        more records
     """
-    if title:
-        # Get the records of the owner, editor or viewer
-        records = list(request.app.database[config["RECORD_TWO_NAME"]].find(
-            {
-                "$and": [
-                    {
-                        "$or": [
-                            {"owner": username},
-                            {"editors": username},
-                            {"viewers": username}
-                        ]
-                    },
-                    {"title": {"$regex": title}}
-                ]
-            }
-        ))
-    else:
-        # Get the records of the owner, editor or viewer
-        records = list(request.app.database[config["RECORD_TWO_NAME"]].find(
-            {
-                "$or": [
-                    {"owner": username},
-                    {"editors": username},
-                    {"viewers": username}
-                ]
-            }
-        ))
-    # Convert the ObjectId to string
-    for record in records:
-        record["id"] = str(record["_id"])
-        del record["_id"]
-    return records
+    # Get the records of the owner, editor or viewer
+    query = readers_services.member_query(username)
+    # The title starts with the title string, and the title or the
+    # description have the words of the search
+    query = search_query(query, title, search)
+    collection = request.app.async_database[config["RECORD_TWO_NAME"]]
+    if search:
+        check_search_cursor(search, cursor)
+        records = collection.find(query).sort(text_score_sort).limit(
+            limit
+        ).batch_size(batch_size)
+        return iter_records(records), None
+    query, next_cursor = await page_bounds(
+        collection, query, limit, cursor
+    )
+    if query is None:
+        return iter_records(None), None
+    records = collection.find(query).sort("_id", 1).batch_size(batch_size)
+    return iter_records(records), next_cursor
@@ -0,0 +1,46 @@
+import re
+
+# Sort the records found by a text search by relevance
+text_score_sort = [("score", {"$meta": "textScore"}), ("_id", 1)]
+
+
+def search_query(query: dict, title: str = None, search: str = None) -> dict:
+    """
+    Add to a query the conditions of the title and the text search
+
+    Parameters
+    ----------
+    query: dict
+        The MongoDB query
+    title: str
+        The beginning of the title. It is matched literally, so the title
+        index is used to find the records
+    search: str
+        Words to search in the title and the description with the text index
+
+    Returns
+    -------
+    dict
+        The query
+    """
+    if title:
+        # Anchored prefix, the metacharacters of the title are escaped
+        query["title"] = {"$regex": f"^{re.escape(title)}"}
+    if search:
+        query["$text"] = {"$search": search}
+    return query
+
+
+def check_search_cursor(search: str, cursor: str):
+    """
+    Check that a text search is not paginated with a cursor. The records of
+    a text search are sorted by relevance, so only the first page is
+    returned
+
+    Raises
+    ------
+    ValueError
+        If both the search and the cursor are given
+    """
+    if search and cursor:
+        raise ValueError("The cursor can not be used with the search")
@@ -2,49 +2,63 @@ from fastapi import Request
 from dotenv import dotenv_values
 
 from . import keycloak_services
+from .user_directory_services import user_directory
+from .count_services import record_counts
+from .log_services import log_counter
+from .metrics_services import metrics, internal_routes
 
 
 config = dotenv_values(".env")
 
 def get_stats(request: Request):
+    # API requests handled by this worker since it started, measured by the
+    # metrics middleware. Each worker has its own count, and a reload starts
+    # it again from 0
+    num_queries = metrics.total(exclude=internal_routes)
     try:
-        # Read uvicorn_log.txt file and count the number of lines
-        f = open("uvicorn_log.txt")
-        lines = f.readlines()
-        num_queries = len(lines)
+        # Count the lines of uvicorn_log.txt, only the new lines are read
+        log_lines = log_counter.count()
         logs = True
     except FileNotFoundError:
-        num_queries = "Unknown"
+        log_lines = "Unknown"
         logs = False
 
     try:
-        num_users = len(keycloak_services.get_all_users())
-        keycloak = True
+        num_users = user_directory.count()
+        keycloak = user_directory.healthy and \
+            keycloak_services.circuit_breaker.state != \
+            keycloak_services.circuit_breaker.OPEN
     except Exception:
         num_users = "Unknown"
         keycloak = False
 
     try:
-        record_one_count = request.app.database[
-            config["RECORD_ONE_NAME"]].count_documents({})
-        mongoDB = True
+        # Counts kept in memory and refreshed in the background
+        counts = record_counts.get(request.app.database)
+        record_one_count = counts[config["RECORD_ONE_NAME"]]
+        record_two_count = counts[config["RECORD_TWO_NAME"]]
+        mongoDB = record_counts.healthy
     except Exception:
         record_one_count = "Unknown"
-        mongoDB = False
-
-    try:
-        record_two_count = request.app.database[
-            config["RECORD_TWO_NAME"]].count_documents({})
-    except Exception:
         record_two_count = "Unknown"
+        mongoDB = False
     stats = {
         "logs": logs,
         "keycloak": keycloak,
         "mongoDB": mongoDB,
         "queries": num_queries,
+        "queries_since": int(metrics.started_at),
+        "log_lines": log_lines,
         "users": num_users,
         config["RECORD_ONE_NAME"]: record_one_count,
         config["RECORD_TWO_NAME"]: record_two_count,
+        "token_cache": keycloak_services.token_cache.stats(),
+        "rejected_tokens": keycloak_services.rejected_token_stats(),
+        "keycloak_circuit": keycloak_services.circuit_breaker.stats(),
+        "admin_token": keycloak_services.admin_token_manager.stats(),
+        "user_directory": user_directory.stats(),
+        "record_counts": record_counts.stats(),
+        "log_counter": log_counter.stats(),
     }
 
     return stats
\ No newline at end of file
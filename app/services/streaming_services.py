@@ -0,0 +1,76 @@
+import json
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from dotenv import dotenv_values
+
+#dotenv_values reads the values from the .env file and create a dictionary object
+config = dotenv_values(".env")
+
+# Number of documents that MongoDB sends in each batch of a cursor
+batch_size = int(config.get('RECORDS_BATCH_SIZE') or 100)
+
+NDJSON = "application/x-ndjson"
+
+
+def _encode(record: dict) -> str:
+    # The same encoding as the JSON responses, so datetimes are in ISO format
+    return json.dumps(
+        jsonable_encoder(record), ensure_ascii=False, separators=(",", ":")
+    )
+
+
+async def json_array_stream(records):
+    """
+    Encode the records of an async iterable as a JSON array, one record at a
+    time
+    """
+    yield "["
+    first = True
+    async for record in records:
+        if first:
+            first = False
+        else:
+            yield ","
+        yield _encode(record)
+    yield "]"
+
+
+async def ndjson_stream(records):
+    """
+    Encode the records of an async iterable as newline delimited JSON, one
+    record per line
+    """
+    async for record in records:
+        yield _encode(record) + "\n"
+
+
+def records_response(
+    records, request: Request, headers: dict = None) -> StreamingResponse:
+    """
+    Make a response that encodes the records while they are read from
+    MongoDB. The records are sent as newline delimited JSON if the client
+    accepts application/x-ndjson, and as a JSON array otherwise
+
+    Parameters
+    ----------
+    records: async iterable
+        The records
+    request: Request
+        The request object
+    headers: dict
+        Headers of the response
+
+    Returns
+    -------
+    StreamingResponse
+        The response
+    """
+    if NDJSON in request.headers.get("accept", ""):
+        return StreamingResponse(
+            ndjson_stream(records), media_type=NDJSON, headers=headers
+        )
+    return StreamingResponse(
+        json_array_stream(records), media_type="application/json",
+        headers=headers
+    )
@@ -0,0 +1,214 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import dotenv_values
+
+from . import keycloak_services
+
+
+#dotenv_values reads the values from the .env file and create a dictionary object
+config = dotenv_values(".env")
+
+
+class UserDirectory:
+    """
+    In-memory copy of the users of the Keycloak realm. The copy is
+    synchronized in the background, so listing, counting and looking for a
+    user do not call Keycloak
+
+    Parameters
+    ----------
+    refresh_interval : int
+        Seconds between two synchronizations with Keycloak
+    lookup_workers : int
+        Maximum number of concurrent requests to Keycloak when looking for
+        users that are not in the directory
+    """
+
+    def __init__(self, refresh_interval: int = 300, lookup_workers: int = 8):
+        self.refresh_interval = refresh_interval
+        self.lookup_workers = lookup_workers
+        self.synced_at = None
+        self.syncs = 0
+        # False when the last synchronization with Keycloak failed
+        self.healthy = True
+        self._by_username = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self, users: list):
+        """
+        Replace the content of the directory with a list of users
+        """
+        by_username = {user['username']: user for user in users}
+        with self._lock:
+            self._by_username = by_username
+            self.synced_at = time.time()
+            self.syncs += 1
+
+    def sync(self):
+        """
+        Get all the users from Keycloak and load them in the directory
+        """
+        try:
+            users = keycloak_services.get_all_users()
+            if 'error' in users:
+                raise RuntimeError(users['error'])
+        except Exception:
+            self.healthy = False
+            raise
+        self.healthy = True
+        self.load(users)
+
+    def is_loaded(self) -> bool:
+        """
+        Check if the directory has been synchronized at least once
+        """
+        return self.synced_at is not None
+
+    def users(self) -> list:
+        """
+        Return the list of users. The directory is synchronized first if it
+        was never loaded
+
+        Returns
+        -------
+        users : list
+            list of all users
+        """
+        if not self.is_loaded():
+            self.sync()
+        with self._lock:
+            return [dict(user) for user in self._by_username.values()]
+
+    def count(self) -> int:
+        """
+        Return the number of users. The directory is synchronized first if
+        it was never loaded
+        """
+        if not self.is_loaded():
+            self.sync()
+        return len(self._by_username)
+
+    def get(self, username: str) -> dict:
+        """
+        Return the user with the given username, or None if the directory
+        does not know the user
+        """
+        user = self._by_username.get(username)
+        if user is None:
+            return None
+        return dict(user)
+
+    def find_unknown(self, usernames: list) -> list:
+        """
+        Check in one pass which usernames do not belong to any user. The
+        usernames are looked for in the directory first, and the ones that
+        are not there are requested to Keycloak concurrently
+
+        Parameters
+        ----------
+        usernames : list
+            usernames to check
+
+        Returns
+        -------
+        unknown : list
+            usernames that do not exist, in the same order as received
+        """
+        misses = {
+            username for username in usernames
+            if self.get(username) is None
+        }
+        if not misses:
+            return []
+        misses = list(misses)
+        with ThreadPoolExecutor(
+                max_workers=min(len(misses), self.lookup_workers)) as pool:
+            found = pool.map(keycloak_services.get_user_by_username, misses)
+            found = dict(zip(misses, found))
+        for user in found.values():
+            if user is not None:
+                self.upsert(user)
+        return [
+            username for username in usernames
+            if username in found and found[username] is None
+        ]
+
+    def upsert(self, user: dict):
+        """
+        Add or replace a user, without waiting for the next synchronization
+        """
+        with self._lock:
+            self._by_username[user['username']] = dict(user)
+
+    def update(self, user_id: str, new_user_information: dict):
+        """
+        Update the fields of a user, without waiting for the next
+        synchronization
+        """
+        with self._lock:
+            for user in self._by_username.values():
+                if user['id'] == user_id:
+                    for key in ['email', 'first_name', 'last_name']:
+                        if new_user_information.get(key) is not None:
+                            user[key] = new_user_information[key]
+                    return
+
+    def remove(self, user_id: str):
+        """
+        Remove a user, without waiting for the next synchronization
+        """
+        with self._lock:
+            self._by_username = {
+                username: user
+                for username, user in self._by_username.items()
+                if user['id'] != user_id
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"ERROR:    Unable to synchronize the users. {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        """
+        Start the background synchronization
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="user-directory", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background synchronization
+        """
+        self._stop.set()
+        self._thread = None
+
+    def stats(self) -> dict:
+        """
+        Return the size of the directory and the age of the last
+        synchronization
+        """
+        return {
+            "size": len(self._by_username),
+            "syncs": self.syncs,
+            "healthy": self.healthy,
+            "age": None if self.synced_at is None else
+                int(time.time() - self.synced_at),
+        }
+
+
+user_directory = UserDirectory(
+    refresh_interval=int(config.get('USER_DIRECTORY_REFRESH') or 300),
+    lookup_workers=int(config.get('USER_DIRECTORY_LOOKUP_WORKERS') or 8)
+)
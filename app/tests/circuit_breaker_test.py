@@ -0,0 +1,128 @@
+import asyncio
+import httpx
+from requests.adapters import BaseAdapter
+
+from ..services import keycloak_services, keycloak_async_services
+from ..services.circuit_breaker_services import CircuitBreaker, \
+    CircuitOpenError
+
+
+class _BrokenAdapter(BaseAdapter):
+    """
+    Adapter that fails with an error that is not a RequestException
+    """
+
+    def send(self, request, **kwargs):
+        raise RuntimeError("broken adapter")
+
+    def close(self):
+        pass
+
+
+def _half_open_breaker():
+    """
+    Return a circuit breaker that allows a probe in the next call
+    """
+    breaker = CircuitBreaker('Test', failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    return breaker
+
+
+def _release_probe_test():
+    """
+    Test that a released probe lets the next call be a new probe.
+    """
+    breaker = _half_open_breaker()
+    breaker.before_call()
+    # Only one probe at a time
+    try:
+        breaker.before_call()
+        assert False, "The second call must be rejected"
+    except CircuitOpenError:
+        pass
+    breaker.release_probe()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    return True
+
+
+def _sync_unexpected_error_test():
+    """
+    Test that a probe of the sync client that fails with an unexpected
+    error does not leave the circuit stuck in half open.
+    """
+    breaker = _half_open_breaker()
+    shared_breaker = keycloak_services.circuit_breaker
+    keycloak_services.circuit_breaker = breaker
+    try:
+        session = keycloak_services.KeycloakSession()
+        session.mount("http://", _BrokenAdapter())
+        try:
+            session.get("http://keycloak.test/")
+            assert False, "The adapter error must be raised"
+        except RuntimeError:
+            pass
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        # The next call is allowed as a new probe
+        breaker.before_call()
+    finally:
+        keycloak_services.circuit_breaker = shared_breaker
+    return True
+
+
+def _async_unexpected_error_test():
+    """
+    Test that a probe of the async client that fails with an unexpected
+    error or is cancelled does not leave the circuit stuck in half open.
+    """
+    async def probe(error):
+        def handler(request):
+            raise error
+        client = keycloak_async_services.KeycloakAsyncClient(
+            transport=httpx.MockTransport(handler)
+        )
+        try:
+            await client.get("http://keycloak.test/")
+            assert False, "The transport error must be raised"
+        except type(error):
+            pass
+        finally:
+            await client.aclose()
+
+    shared_breaker = keycloak_async_services.circuit_breaker
+    try:
+        for error in [RuntimeError("broken"), asyncio.CancelledError()]:
+            breaker = _half_open_breaker()
+            keycloak_async_services.circuit_breaker = breaker
+            asyncio.run(probe(error))
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            # The next call is allowed as a new probe
+            breaker.before_call()
+    finally:
+        keycloak_async_services.circuit_breaker = shared_breaker
+    return True
+
+
+def test_all_test():
+    """
+    The circuit breaker is tested without connecting to Keycloak, the
+    requests fail before leaving the HTTP clients.
+
+    Procedure:
+    1. Check that a released probe lets the next call be a new probe
+    2. Check that an unexpected error in a probe of the sync client does not
+    leave the circuit stuck in half open
+    3. Check that an unexpected error or a cancellation in a probe of the
+    async client does not leave the circuit stuck in half open
+    """
+    # 1. Check that a released probe lets the next call be a new probe
+    _release_probe_test()
+    # 2. Check that an unexpected error in a probe of the sync client does
+    # not leave the circuit stuck in half open
+    _sync_unexpected_error_test()
+    # 3. Check that an unexpected error or a cancellation in a probe of the
+    # async client does not leave the circuit stuck in half open
+    _async_unexpected_error_test()
@@ -0,0 +1,158 @@
+import asyncio
+import dotenv
+from types import SimpleNamespace
+from bson.errors import InvalidDocument
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from ..services import content_services, database_services, \
+    record_one_services
+
+# Import the dotenv library to load environment variables from .env file
+config = dotenv.dotenv_values(".env")
+
+mongo_uri = f'mongodb://{config["MONGO_ADMIN"]}:' + \
+    f'{config["MONGO_ADMIN_PASSWORD"]}@{config["MONGO_HOST"]}:' + \
+    f'{config["MONGO_PORT"]}/?authMechanism=DEFAULT'
+
+
+def _rows(tag: str, number: int) -> list:
+    """
+    Rows of a test append, tagged to know which append wrote them
+    """
+    return [{"append": tag, "row": row} for row in range(number)]
+
+
+async def _create_test_record(request) -> str:
+    """
+    Create a record that stores its content in buckets
+    """
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    # Remove the record of a previous run that did not finish
+    await collection.delete_many({"title": "test_content_buckets"})
+    result = await collection.insert_one({
+        "title": "test_content_buckets",
+        "content_storage": content_services.BUCKETS,
+        "content_count": 0,
+        "version": 0,
+    })
+    return str(result.inserted_id)
+
+
+async def _delete_test_record(record_id: str, request):
+    """
+    Delete the test record and its buckets
+    """
+    collection = request.app.async_database[config["RECORD_ONE_NAME"]]
+    await collection.delete_many({"title": "test_content_buckets"})
+    await content_services.delete_rows(record_id, request)
+
+
+async def _out_of_order_writes_test(record_id: str, request):
+    """
+    Test that rows written after the rows of a later position are read in
+    their place.
+    """
+    first = _rows("first", 3)
+    # The rows cross the end of the first bucket
+    second = _rows("second", content_services.bucket_size)
+    await content_services.append_rows(record_id, second, 3, request)
+    await content_services.append_rows(record_id, first, 0, request)
+    rows = await content_services.read_rows(record_id, request)
+    assert rows == first + second
+    rows = await content_services.read_rows(
+        record_id, request, start=2, stop=5
+    )
+    assert rows == first[2:] + second[:2]
+    rows = await content_services.read_fields(record_id, ["row"], request)
+    assert rows == [{"row": row["row"]} for row in first + second]
+    await content_services.delete_rows(record_id, request)
+    return True
+
+
+async def _concurrent_appends_test(record_id: str, request):
+    """
+    Test that two overlapping appends keep the rows of each append together
+    and in order.
+    """
+    number = content_services.bucket_size + 5
+    first, second = _rows("first", number), _rows("second", number)
+    results = await asyncio.gather(
+        record_one_services.append_record_one_buckets(
+            record_id, first, None, request
+        ),
+        record_one_services.append_record_one_buckets(
+            record_id, second, None, request
+        ),
+    )
+    assert all(result is not None for result in results)
+    record = await record_one_services.get_record_one(record_id, request)
+    assert record["content_count"] == 2 * number
+    assert record["content"] in [first + second, second + first]
+    # The appends fill the buckets instead of adding documents
+    buckets = await request.app.async_database[
+        content_services.content_collection_name
+    ].count_documents({"record_id": ObjectId(record_id)})
+    assert buckets == -(-2 * number // content_services.bucket_size)
+    return True
+
+
+async def _failed_append_test(record_id: str, request):
+    """
+    Test that an append whose rows can not be written releases its
+    positions.
+    """
+    record = await record_one_services.get_record_one(record_id, request)
+    # A row that can not be encoded makes the write fail
+    failed = False
+    try:
+        await record_one_services.append_record_one_buckets(
+            record_id, [{"row": object()}], None, request
+        )
+    except InvalidDocument:
+        failed = True
+    assert failed
+    after = await record_one_services.get_record_one(record_id, request)
+    assert after["content_count"] == record["content_count"]
+    assert after["content"] == record["content"]
+    assert after["version"] > record["version"]
+    return True
+
+
+async def _all_tests():
+    motor_client = AsyncIOMotorClient(mongo_uri)
+    request = SimpleNamespace(app=SimpleNamespace(
+        async_database=motor_client[config["MONGO_DB_NAME"]]
+    ))
+    record_id = await _create_test_record(request)
+    try:
+        # 1. Check that rows written out of order are read in their place
+        await _out_of_order_writes_test(record_id, request)
+        # 2. Check that two overlapping appends keep their rows in order
+        await _concurrent_appends_test(record_id, request)
+        # 3. Check that a failed append releases its positions
+        await _failed_append_test(record_id, request)
+    finally:
+        await _delete_test_record(record_id, request)
+        motor_client.close()
+
+
+def test_all_test():
+    """
+    The content stored in buckets is tested directly against MongoDB,
+    without KeyCloak.
+
+    Procedure:
+    1. Check that rows written out of order are read in their place
+    2. Check that two overlapping appends keep their rows in order
+    3. Check that a failed append releases its positions
+    """
+    mongodb_client = MongoClient(mongo_uri)
+    try:
+        database = mongodb_client[config["MONGO_DB_NAME"]]
+        # The buckets need the current indexes
+        database_services.ensure_indexes(database)
+        asyncio.run(_all_tests())
+    finally:
+        mongodb_client.close()
@@ -0,0 +1,44 @@
+import ssl
+import asyncio
+import dotenv
+
+from ..services import keycloak_async_services
+
+# Import the dotenv library to load environment variables from .env file
+config = dotenv.dotenv_values(".env")
+
+
+def _async_transport_test():
+    """
+    Test that the transport of the async client does not verify the
+    certificate of Keycloak and uses the configured pool and retries.
+    """
+    async def check():
+        client = keycloak_async_services.http_client()
+        try:
+            pool = client._transport._pool
+            assert pool._ssl_context.verify_mode == ssl.CERT_NONE
+            assert not pool._ssl_context.check_hostname
+            pool_maxsize = int(config.get('KEYCLOAK_POOL_MAXSIZE') or 20)
+            assert pool._max_connections == pool_maxsize
+            assert pool._max_keepalive_connections == pool_maxsize
+            assert pool._retries == \
+                int(config.get('KEYCLOAK_RETRIES') or 2)
+        finally:
+            await keycloak_async_services.close_http_client()
+
+    asyncio.run(check())
+    return True
+
+
+def test_all_test():
+    """
+    The HTTP clients of Keycloak are tested without connecting to Keycloak.
+
+    Procedure:
+    1. Check that the transport of the async client has the TLS, pool and
+    retries settings
+    """
+    # 1. Check that the transport of the async client has the TLS, pool and
+    # retries settings
+    _async_transport_test()
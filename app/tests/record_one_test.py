@@ -286,7 +286,7 @@ def _check_record_user_one_filtered_by_title(client):
     token = response.json()["access_token"]
     # Get all resources with the token from test_user_1
     response = client.get(
-        f"/{config['RECORD_ONE_NAME']}/me?title=2",
+        f"/{config['RECORD_ONE_NAME']}/me?title=test_record_2",
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 200
@@ -309,7 +309,7 @@ def _check_records_user_one_filtered_by_title(client):
     )
     # Get all resources with the token from test_user_1
     response = client.get(
-        f"/{config['RECORD_ONE_NAME']}?title=2",
+        f"/{config['RECORD_ONE_NAME']}?title=test_record_2",
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 200
@@ -1,3 +1,4 @@
+import json
 import dotenv
 
 from fastapi.testclient import TestClient
@@ -142,7 +143,7 @@ def _check_record_user_one_filtered_by_title(client):
     token = response.json()["access_token"]
     # Get all resources with the token from test_user_1
     response = client.get(
-        f"/{config['RECORD_TWO_NAME']}/me?title=2",
+        f"/{config['RECORD_TWO_NAME']}/me?title=test_record_2",
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 200
@@ -229,6 +230,14 @@ def _update_test_record(client):
     )
     assert response.status_code == 200
     assert response.json()["visible"] == new_record["visible"]
+    # The title of another record can not be used
+    response = client.put(
+        f"/{config['RECORD_TWO_NAME']}/{record_id}",
+        json={"title": "test_record_2"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Title already exists"
     return True
 
 
@@ -281,11 +290,104 @@ def _check_records_user_one_filtered_by_title(client):
     token = response.json()["access_token"]
     # Get all resources with the token from test_user_1
     response = client.get(
-        f"/{config['RECORD_TWO_NAME']}?title=2",
+        f"/{config['RECORD_TWO_NAME']}?title=test_record_2",
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 200
     assert len(response.json()) >= 1
+    # Search the words of the title with the text index
+    response = client.get(
+        f"/{config['RECORD_TWO_NAME']}?search=test_record_2",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    assert len(response.json()) >= 1
+    assert "X-Next-Cursor" not in response.headers
+
+
+def _check_records_user_one_paginated(client):
+    """
+    Check that the records of test_user_1 can be read one by one following
+    the cursor of the next page
+    """
+    # Get token from test_user_1
+    response = client.post(
+        "/token", data={"username": "test_user_1", "password": "test_password"}
+    )
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    # Get the pages of one record with the token from test_user_1
+    record_ids = []
+    url = f"/{config['RECORD_TWO_NAME']}/me?limit=1"
+    while url:
+        response = client.get(
+            url, headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200
+        assert len(response.json()) <= 1
+        record_ids += [record["id"] for record in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor:
+            url = f"/{config['RECORD_TWO_NAME']}/me?limit=1&cursor={cursor}"
+        else:
+            url = None
+    assert len(record_ids) >= 3
+    assert len(record_ids) == len(set(record_ids))
+    # Get the same records as newline delimited JSON
+    response = client.get(
+        f"/{config['RECORD_TWO_NAME']}/me",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/x-ndjson"
+        }
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert [json.loads(line)["id"] for line in lines] == record_ids
+    # Check that an invalid cursor is rejected
+    response = client.get(
+        f"/{config['RECORD_TWO_NAME']}/me?cursor=invalid",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 400
+
+
+def _delete_records_user_one_bulk(client):
+    """
+    Delete all the records of test_user_1 in one request
+    """
+    # Get token from test_user_1
+    response = client.post(
+        "/token", data={"username": "test_user_1", "password": "test_password"}
+    )
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    response = client.get(
+        f"/{config['RECORD_TWO_NAME']}/me",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    record_ids = [record["id"] for record in response.json()]
+    assert len(record_ids) >= 1
+    # Delete the records and an id that does not exist
+    unknown_id = "000000000000000000000000"
+    response = client.delete(
+        f"/{config['RECORD_TWO_NAME']}",
+        params={"ids": record_ids + [unknown_id]},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    assert response.json()["deleted"] == len(record_ids)
+    assert response.json()["not_found"] == [unknown_id]
+    response = client.get(
+        f"/{config['RECORD_TWO_NAME']}/me",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    assert response.json() == []
+    return True
+
 
 def test_all_test():
     """
@@ -331,7 +433,8 @@ def test_all_test():
     9. Check that the record exists when get the list of records without a token
         Tested endpoints:
         - GET /record
-    10. Update the record with the token from test_user_1
+    10. Update the record with the token from test_user_1, and check that it
+        can not get the title of another record
         Tested endpoints:
         - POST /token
         - PUT /record/{record_id}
@@ -352,6 +455,15 @@ def test_all_test():
         Tested endpoints:
         - POST /token
         - GET /record/me
+    15. Check that the records of test_user_1 can be read page by page
+        Tested endpoints:
+        - POST /token
+        - GET /record/me
+    16. Delete all the records of test_user_1 in one request
+        Tested endpoints:
+        - POST /token
+        - GET /record/me
+        - DELETE /record
     Pre-last. Delete all test records (again)
     Last. Delete all test users (again)
     """
@@ -391,6 +503,10 @@ def test_all_test():
         # 14. Check that the record does not exists when get the list of records
         # with the token from test_user_2
         _check_no_records_user_two(client)
+        # 15. Check that the records of test_user_1 can be read page by page
+        _check_records_user_one_paginated(client)
+        # 16. Delete all the records of test_user_1 in one request
+        _delete_records_user_one_bulk(client)
         # Pre-last. Delete all test resources (again)
         _delete_test_records(client)
         # Last. Delete all test users (again)
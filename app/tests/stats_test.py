@@ -12,6 +12,17 @@ def _stats_test(client):
     return True
 
 
+def _metrics_test(client):
+    """
+    Test the GET /metrics endpoint.
+    """
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "http_requests_total" in response.text
+    assert 'route="/stats"' in response.text
+    return True
+
+
 def test_all_test():
     """
     In order to run the tests, connections to KeyCloak and MongoDB need to be
@@ -21,7 +32,10 @@ def test_all_test():
 
     Procedure:
     1. Check that GET /stats returns 200
+    2. Check that GET /metrics returns the request of the step 1
     """
     with TestClient(app) as client:
         # 1. Check that GET /stats returns 200
         _stats_test(client)
+        # 2. Check that GET /metrics returns the request of the step 1
+        _metrics_test(client)